@@ -0,0 +1,520 @@
+# benchmark for TreeNet corpus extraction
+# usage: python bench.py <data_path> [max_workers]
+#        python bench.py reader <data_path>
+#        python bench.py cache <data_path>
+#        python bench.py memory <data_path>
+#        python bench.py clean <data_path>
+#        python bench.py sketch <data_path> [min_freq] [sketch_mb ...]
+#        python bench.py generate <out_folder> <n_trees> [seed]
+#        python bench.py suite <results.json> [n_trees ...]
+#        python bench.py compare <old.json> <new.json>
+
+
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import treenet as tnt
+
+# resource is only available on Unix. Elsewhere the peak memory columns are left as nan
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    '''Peak memory of this process so far, in MB, or nan where it cannot be measured, e.g. on Windows'''
+    if resource is None:
+        return float("nan")
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+def read_outputs(out_folder):
+    '''Read the TreeNet output files in a folder, so that runs can be compared
+    :param out_folder: string with the path to a folder with TreeNet output
+    :return: a list of strings with the contents of the output files, ordered by file type
+    '''
+    outputs = []
+    for path in sorted(glob.glob(os.path.join(out_folder, "treenet_*.txt"))):
+        with open(path) as f:
+            outputs.append(f.read())
+    return outputs
+
+
+def time_run(corpus_files, **kwargs):
+    '''Time a single call to get_constructions() with its output discarded
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    :param kwargs: further arguments passed on to get_constructions()
+    :return: a tuple with the wall clock time in seconds and the contents of the output files
+    '''
+    out_folder = tempfile.mkdtemp()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            tnt.get_constructions(corpus_files, out_folder, **kwargs)
+            elapsed = time.perf_counter() - start
+        return elapsed, read_outputs(out_folder)
+    finally:
+        shutil.rmtree(out_folder)
+
+
+def bench_workers(corpus_files, max_workers):
+    '''Compare serial extraction with extraction in 2, 4, ... max_workers processes
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    :param max_workers: int with the largest number of worker processes to try
+    '''
+    serial_time, serial_outputs = time_run(corpus_files, min_freq=1, workers=1)
+    print("workers\tseconds\tspeedup\tsame_output")
+    print("{}\t{:.2f}\t{:.2f}\t{}".format(1, serial_time, 1.0, True))
+    workers = 2
+    while workers <= max_workers:
+        elapsed, outputs = time_run(corpus_files, min_freq=1, workers=workers)
+        print("{}\t{:.2f}\t{:.2f}\t{}".format(workers, elapsed, serial_time / elapsed, outputs == serial_outputs))
+        workers *= 2
+
+
+def line_loop_trees(file):
+    '''The line-based reader that TreeNet used before iter_trees(), without its cleaning and counting, as the baseline
+    of bench_reader(). It only sees constituents on lines that are one tab in, see bench.indentation()
+    :param file: string with the path to a corpus file
+    :return: a generator of (tree ID, list of lines) tuples, one per IP-MAT tree
+    '''
+    in_tree = False
+    with open(file, 'r') as f:
+        for line in f:
+            begin_tree_match = re.match(r'.*?\(IP-MAT.*?(\(ADVP|PP.*?)?', line)
+            if begin_tree_match:
+                in_tree = True
+                wo_list = [line.strip()]
+            if in_tree:
+                # check that we are one tab indentations in
+                if len(line.split("\t")) == 2:
+                    wo_list.append(line.strip())
+                else:
+                    continue
+                end_tree_match = re.match(r'.*?\(ID (CM.*?)\).*?', line)
+                if end_tree_match:
+                    in_tree = False
+                    yield end_tree_match.group(1), wo_list
+
+
+def bench_reader(corpus_files):
+    '''Time the tree reader on its own, without cleaning or counting, against the line-based reader it replaced
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    '''
+    parsed_files = sorted(glob.glob(os.path.join(corpus_files, "*.psd")))
+    line_count = 0
+    for file in parsed_files:
+        with open(file) as f:
+            line_count += sum(1 for line in f)
+    print("reader\tlines\ttrees\tseconds\tlines/sec\ttrees/sec")
+    for name, reader in (("line loop", line_loop_trees), ("iter_trees", tnt.iter_trees)):
+        tree_count = 0
+        start = time.perf_counter()
+        for file in parsed_files:
+            for tree in reader(file):
+                tree_count += 1
+        elapsed = time.perf_counter() - start
+        print("{}\t{}\t{}\t{:.2f}\t{:.0f}\t{:.0f}".format(name, line_count, tree_count, elapsed, line_count / elapsed, tree_count / elapsed))
+
+
+def bench_clean(corpus_files):
+    '''Time clean_elements() per tree, and report how often its memo cache was hit
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    '''
+    parsed_files = sorted(glob.glob(os.path.join(corpus_files, "*.psd")))
+    trees = [wo_list for file in parsed_files for id, wo_list in tnt.iter_trees(file)]
+    start = time.perf_counter()
+    for wo_list in trees:
+        tnt.clean_elements(wo_list)
+    elapsed = time.perf_counter() - start
+    cache_info = tnt.clean_elements_cache_info()
+    print("trees\tus/tree\tlabels\thits\tmisses")
+    print("{}\t{:.2f}\t{}\t{}\t{}".format(len(trees), elapsed / len(trees) * 1e6, cache_info["labels"], cache_info["hits"], cache_info["misses"]))
+
+
+def bench_cache(corpus_files):
+    '''Compare a run with an empty count cache against reruns that read the counts from the cache
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    '''
+    cache_dir = tempfile.mkdtemp()
+    try:
+        print("run\tseconds\tsame_output")
+        cold_time, cold_outputs = time_run(corpus_files, min_freq=1, cache_dir=cache_dir)
+        print("{}\t{:.2f}\t{}".format("cold", cold_time, True))
+        warm_time, warm_outputs = time_run(corpus_files, min_freq=1, cache_dir=cache_dir)
+        print("{}\t{:.2f}\t{}".format("warm", warm_time, warm_outputs == cold_outputs))
+        warm_time, warm_outputs = time_run(corpus_files, min_freq=5, cache_dir=cache_dir)
+        print("{}\t{:.2f}\t{}".format("warm, min_freq=5", warm_time, "-"))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def extract_dict_layout(parsed_files):
+    '''Count constructions with the dict-of-strings layout TreeNet used before CountState, for memory comparisons
+    :param parsed_files: list of paths to .psd files
+    :return: a tuple with the five count dictionaries
+    '''
+    cx_count_dict = {}
+    cx_id_dict = {}
+    cx_id_dict_broad = {}
+    cx_narrow_to_broad = {}
+    elements_global_count = {}
+    id_to_file_dict = {}
+    for file in parsed_files:
+        file_name_clean = os.path.basename(file).replace(".psd", "")
+        for id, wo_list in tnt.iter_trees(file):
+            wo_list_clean, wo_list_clean_broad = tnt.clean_elements(wo_list)
+            wo_list_clean_str = " ".join(wo_list_clean)
+            wo_list_clean_broad_str = " ".join(wo_list_clean_broad)
+            if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:
+                id_to_file_dict[id] = file_name_clean
+                cx_id_dict[wo_list_clean_str] = id
+                cx_id_dict_broad[wo_list_clean_broad_str] = id
+                cx_narrow_to_broad[wo_list_clean_str] = wo_list_clean_broad_str
+                for e in wo_list_clean:
+                    elements_global_count[e] = elements_global_count.get(e, 0) + 1
+                cx_count_dict[wo_list_clean_str] = cx_count_dict.get(wo_list_clean_str, 0) + 1
+    return cx_count_dict, cx_id_dict, cx_id_dict_broad, cx_narrow_to_broad, elements_global_count, id_to_file_dict
+
+
+def peak_rss(layout, corpus_files):
+    '''Count a corpus with one of the count layouts and measure the peak memory of the process, see bench_memory()
+    :return: a tuple with the peak RSS in MB before and after counting
+    '''
+    parsed_files = sorted(glob.glob(os.path.join(corpus_files, "*.psd")))
+    before = peak_rss_mb()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if layout == "dict":
+            counts = extract_dict_layout(parsed_files)
+        else:
+            counts = tnt.extract_corpus(parsed_files)
+    after = peak_rss_mb()
+    return before, after
+
+
+def bench_memory(corpus_files):
+    '''Compare the peak memory of the dict-of-strings layout with the interned CountState layout
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    '''
+    print("layout\tbaseline_mb\tpeak_mb\tcounts_mb")
+    for layout in ("dict", "CountState"):
+        before, after = run_in_process(peak_rss, layout, corpus_files)
+        print("{}\t{:.1f}\t{:.1f}\t{:.1f}".format(layout, before, after, after - before))
+
+
+def bench_sketch(corpus_files, min_freq=5, sizes=(1, 4, 16)):
+    '''Compare the exact mode with the approximate mode at several sketch sizes, for memory use and recall
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    :param min_freq: int with minimum number of cx occurrences. Defaults to 5
+    :param sizes: list of floats with sketch sizes in megabytes. Defaults to 1, 4 and 16 MB
+    '''
+    print("mode\tseconds\tpeak_mb\trecall\tsame_counts")
+    for sketch_mb in (None,) + tuple(sizes):
+        run = run_in_process(measure_run, corpus_files, min_freq, False, sketch_mb, True)
+        elapsed, peak, rows = run["seconds"], run["peak_rss_mb"], run["rows"]
+        if sketch_mb is None:
+            exact_rows = rows
+        found = set(row.split("\t")[1] for row in rows)
+        recall = sum(1 for row in exact_rows if row.split("\t")[1] in found) / float(len(exact_rows))
+        print("{}\t{:.2f}\t{:.1f}\t{:.4f}\t{}".format("exact" if sketch_mb is None else "sketch {} MB".format(sketch_mb),
+                                                   elapsed, peak, recall, rows == exact_rows))
+
+
+# Synthetic corpus generator
+
+# sentence-level constituents of the synthetic trees, with their relative frequencies. Each constituent is a nested
+# list of (label, children) pairs, where the children are either a list of constituents or a word
+synthetic_subjects = [(30, ("NP-SBJ", [("PRO", "he")])), (15, ("NP-SBJ", [("D", "the"), ("N", "kyng")])),
+                      (10, ("NP-SBJ", [("NPR", "Arthur")])), (6, ("NP-SBJ", [("N", "God")])),
+                      (4, ("NP-SBJ", [("Q", "all"), ("NS", "knyghtes")])), (3, ("NP-SBJ-1", [("PRO", "they")])),
+                      (2, ("NP-SBJ", [("D", "the"), ("N", "quene"), ("PP", [("P", "of"), ("NP", [("NPR", "Orkeney")])])])),
+                      (2, ("NP-SBJ", "*exp*")), (1, ("NP-SBJ", "*con*"))]
+synthetic_verbs = [(25, ("VBD", "seyde")), (10, ("VBP", "seyth")), (10, ("BED", "was")), (6, ("BEP", "is")),
+                   (8, ("MD", "shall")), (5, ("HVD", "had")), (3, ("HVP", "hath")), (2, ("DOD", "dyd")),
+                   (1, ("NEG+VBD", "nolde")), (1, ("NEG+BEP", "nys"))]
+synthetic_complements = [(12, ("NP-OB1", [("PRO", "hym")])), (8, ("NP-OB1", [("D", "the"), ("N", "swerd")])),
+                         (3, ("NP-OB2", [("PRO", "hem")])), (14, ("PP", [("P", "to"), ("NP", [("D", "the"), ("N", "castel")])])),
+                         (6, ("PP", [("P", "in"), ("NP", [("N", "londe")])])), (6, ("ADJP", [("ADVR", "wonderly"), ("ADJ", "wroth")])),
+                         (4, ("IP-INF", [("TO", "to"), ("VB", "fyght")])), (3, ("RP", "forth")), (3, ("NEG", "not")),
+                         (3, ("CP-THT", [("C", "that"), ("IP-SUB", [("NP-SBJ", [("PRO", "he")]), ("VBD", "cam")])])),
+                         (2, ("NP-PRD", [("D", "a"), ("ADJ", "good"), ("N", "knyght")])), (1, ("Q", "moche"))]
+synthetic_adjuncts = [(10, ("ADVP-TMP", [("ADV", "Thenne")])), (6, ("ADVP", [("ADV", "so")])), (4, ("ADVP-LOC", [("ADV", "there")])),
+                      (5, ("CP-ADV", [("P", "whan"), ("C", "0"), ("IP-SUB", [("NP-SBJ", [("PRO", "he")]), ("VBD", "sawe"), ("NP-OB1", [("PRO", "hym")])])])),
+                      (3, ("PP", [("P", "with"), ("NP", [("PRO$", "his"), ("N", "swerd")])])), (1, ("FP", "but"))]
+# verbs that are followed by a non-finite verb
+synthetic_auxiliaries = {"MD": ("VB", "fyght"), "HVD": ("VBN", "slayne"), "HVP": ("VBN", "done")}
+# labels of matrix clauses, and of the trees that are not clauses
+synthetic_clause_labels = [(90, "IP-MAT"), (6, "IP-MAT-SPE"), (1, "IP-MAT-PRN")]
+synthetic_other_trees = [(3, ("CODE", "<P_1>")), (1, ("FRAG", [("NP", [("N", "Explicit")])]))]
+
+
+def weighted(rng, choices):
+    '''Draw an item from a list of (weight, item) tuples'''
+    return rng.choices([item for weight, item in choices], [weight for weight, item in choices])[0]
+
+
+def indentation(column):
+    '''White space up to a column, as in the corpus files: a tab for every eight columns, then spaces. Sentence level
+    constituents are one tab and two spaces in, see synthetic_tree()'''
+    return "\t" * (column // 8) + " " * (column % 8)
+
+
+def format_constituent(constituent, indent):
+    '''Write a constituent in the Penn-Helsinki layout, with phrases that have phrases inside on several lines
+    :param constituent: a (label, children) tuple, see synthetic_subjects
+    :param indent: int with the column of the opening bracket
+    :return: string with the constituent, without a trailing new line
+    '''
+    label, children = constituent
+    if isinstance(children, str):
+        return "({} {})".format(label, children)
+    head = "({} ".format(label)
+    if all(isinstance(grandchildren, str) for child_label, grandchildren in children):
+        return head + " ".join(format_constituent(child, 0) for child in children) + ")"
+    child_indent = indent + len(head)
+    lines = [format_constituent(child, child_indent) for child in children]
+    return head + ("\n" + indentation(child_indent)).join(lines) + ")"
+
+
+def synthetic_tree(rng, tree_id):
+    '''Make a random tree, mostly matrix clauses with a subject, a verb, complements and adjuncts in varying orders
+    :param rng: random.Random instance
+    :param tree_id: string with the tree ID, e.g. "CMMALORY,12.3"
+    :return: string with the tree in the Penn-Helsinki layout
+    '''
+    if rng.random() < 0.04:
+        return "( {}\n\t(ID {}))\n".format(format_constituent(weighted(rng, synthetic_other_trees), 2), tree_id)
+    subject = weighted(rng, synthetic_subjects)
+    verb = weighted(rng, synthetic_verbs)
+    verbs = [verb]
+    if verb[0] in synthetic_auxiliaries:
+        verbs.append(synthetic_auxiliaries[verb[0]])
+    after = [weighted(rng, synthetic_complements) for i in range(rng.choice((0, 1, 1, 1, 2, 2, 3)))]
+    before = [weighted(rng, synthetic_adjuncts) for i in range(rng.choice((0, 0, 0, 1, 1, 2)))]
+    if rng.random() < 0.3:
+        after.append(weighted(rng, synthetic_adjuncts))
+    if before and rng.random() < 0.5:
+        # verb second order after a fronted adjunct
+        children = before + verbs[:1] + [subject] + verbs[1:] + after
+    else:
+        children = before + [subject] + verbs + after
+    if rng.random() < 0.2:
+        children.insert(0, ("CONJ", "and"))
+    if rng.random() < 0.1:
+        children.insert(rng.randint(1, len(children)), (",", ","))
+    children.append((".", "."))
+    clause = (weighted(rng, synthetic_clause_labels), children)
+    return "( {}\n\t(ID {}))\n".format(format_constituent(clause, 2), tree_id)
+
+
+def generate_corpus(out_folder, n_trees, n_files=None, seed=0):
+    '''Write a synthetic corpus of .psd files named after the ME corpus files, for benchmarks
+    :param out_folder: string with the path to the folder for the corpus files
+    :param n_trees: int with the number of trees in the corpus, divided evenly over the files
+    :param n_files: int with the number of files, at most one for each file in treenet.me_dates. Defaults to None (all of them)
+    :param seed: int with the seed of the random generator, the same seed gives the same corpus. Defaults to 0
+    :return: a list of paths to the corpus files
+    '''
+    if not os.path.isdir(out_folder):
+        os.makedirs(out_folder)
+    file_names = sorted(tnt.me_dates)[:n_files]
+    file_names = file_names[:max(1, min(len(file_names), n_trees))]
+    rng = random.Random(seed)
+    paths = []
+    for i, file_name in enumerate(file_names):
+        file_trees = n_trees // len(file_names) + (1 if i < n_trees % len(file_names) else 0)
+        id_prefix = file_name.split(".")[0].upper()
+        path = os.path.join(out_folder, file_name + ".psd")
+        with open(path, 'w') as f:
+            for j in range(file_trees):
+                # about 20 trees to a page, as in the ID lines of the corpus
+                f.write(synthetic_tree(rng, "{},{}.{}".format(id_prefix, j // 20 + 1, j + 1)))
+                f.write("\n")
+        paths.append(path)
+    return paths
+
+
+# Benchmark suite
+
+def stage_times(corpus_files, out_folder, min_freq):
+    '''Run the steps of get_constructions() one at a time, and time each step
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    :param out_folder: string with the path to folder where results are saved
+    :param min_freq: int with minimum number of cx occurrences
+    :return: a dict with the seconds spent reading trees (parse), cleaning them (clean), counting them (count),
+     scoring the constructions (score) and writing the output files (write)
+    '''
+    times = dict.fromkeys(("parse", "clean", "count", "score", "write"), 0.0)
+    clock = time.perf_counter
+    state = tnt.CountState()
+    spill_dir = tempfile.mkdtemp()
+    try:
+        for i, file in enumerate(sorted(glob.glob(os.path.join(corpus_files, "*.psd")))):
+            file_name_clean = os.path.basename(file).replace(".psd", "")
+            start = clock()
+            trees = list(tnt.iter_trees(file))
+            times["parse"] += clock() - start
+            start = clock()
+            cleaned = [(id, tnt.clean_elements(wo_list)) for id, wo_list in trees]
+            times["clean"] += clock() - start
+            # the counting mirrors extract_file()
+            start = clock()
+            spill_path = os.path.join(spill_dir, "{:06d}.spill".format(i))
+            state.filenames_list.append(file_name_clean)
+            state.spill_files.append(spill_path)
+            state.sent_count[file_name_clean] = len(trees)
+            with open(spill_path, 'w') as spill:
+                spill_writer = tnt.RowWriter(spill)
+                for id, (wo_list_clean, wo_list_clean_broad) in cleaned:
+                    if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:
+                        state.add_tree(wo_list_clean, wo_list_clean_broad)
+                        spill_writer.write("{}\t{}\n".format(" ".join(wo_list_clean), id))
+                spill_writer.flush()
+            times["count"] += clock() - start
+
+        table = state.patterns
+        start = clock()
+        pruned_rows = [row for row, v in enumerate(table.counts) if v >= min_freq]
+        cx_metrics = tnt.get_state_total_correlation(state, pruned_rows)
+        times["score"] = clock() - start
+
+        start = clock()
+        cx_pruned_metrics = {}
+        with open(os.path.join(out_folder, "treenet_aggregated.txt"), 'w') as out_agg:
+            for row, my_metrics in zip(pruned_rows, cx_metrics):
+                k = state.vocab.decode(table.narrow[row])
+                k_broad = state.vocab.decode(table.broad_patterns[table.broad[row]])
+                cx_pruned_metrics[k] = k_broad, my_metrics[0], my_metrics[1]
+                out_agg.write("\t".join([str(x) for x in (k_broad, k, table.counts[row], my_metrics[0], my_metrics[1])]) + "\n")
+        tnt.write_full_data(state, cx_pruned_metrics, os.path.join(out_folder, "treenet_full_data.txt"), sep="\t")
+        times["write"] = clock() - start
+    finally:
+        shutil.rmtree(spill_dir)
+    return times
+
+
+def measure_run(corpus_files, min_freq, stages, sketch_mb=None, rows=False):
+    '''Measure a run on a corpus, in a process of its own so that its peak memory can be read, see bench_suite()
+    :param corpus_files: string with the path to folder containing corpus parsed files (.*psd)
+    :param min_freq: int with minimum number of cx occurrences
+    :param stages: bool, time the steps of the run with stage_times() instead of running get_constructions()
+    :param sketch_mb: float with the size of the count-min sketch of get_constructions(), see bench_sketch(). Defaults to None (exact mode)
+    :param rows: bool, also return the rows of the aggregated output. Defaults to False
+    :return: a dict with the seconds of the run, the peak RSS in MB, for stages the seconds of each step, and for rows
+     a list of strings with the aggregated output rows
+    '''
+    out_folder = tempfile.mkdtemp()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            if stages:
+                result = {"stages": stage_times(corpus_files, out_folder, min_freq)}
+            else:
+                tnt.get_constructions(corpus_files, out_folder, min_freq=min_freq, sketch_mb=sketch_mb)
+                result = {}
+            result["seconds"] = time.perf_counter() - start
+        # read before the output, which can be larger than the counts
+        result["peak_rss_mb"] = peak_rss_mb()
+        if rows:
+            with open(glob.glob(os.path.join(out_folder, "treenet_aggregated_*.txt"))[0]) as f:
+                result["rows"] = f.read().splitlines()[1:]
+    finally:
+        shutil.rmtree(out_folder)
+    return result
+
+
+def run_in_process(func, *args):
+    '''Call a function in a fresh process, so that the peak memory of earlier runs does not mask its own'''
+    pool = multiprocessing.get_context("spawn").Pool(1)
+    try:
+        return pool.apply(func, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def bench_suite(results_path, sizes=(10000, 100000, 1000000), min_freq=5, seed=0):
+    '''Generate synthetic corpora of several sizes, measure get_constructions() on each, and save the results as JSON
+    :param results_path: string with the path of the JSON file for the results
+    :param sizes: list of ints with the number of trees in each corpus. Defaults to 10k, 100k and 1M trees
+    :param min_freq: int with minimum number of cx occurrences. Defaults to 5
+    :param seed: int with the seed of the corpus generator. Defaults to 0
+    :return: a dict with the results
+
+    Each size is run twice in fresh processes: once through get_constructions() for the throughput and the peak
+    memory, and once step by step for the time of each stage.
+    '''
+    results = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+               "platform": platform.platform(), "numpy": tnt.np.__version__ if tnt.np is not None else None,
+               "cpus": os.cpu_count(), "min_freq": min_freq, "seed": seed, "runs": []}
+    print("trees\tseconds\ttrees/sec\tpeak_mb\tparse\tclean\tcount\tscore\twrite")
+    for n_trees in sizes:
+        corpus_files = tempfile.mkdtemp()
+        try:
+            generate_corpus(corpus_files, n_trees, seed=seed)
+            corpus_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(corpus_files, "*.psd")))
+            run = run_in_process(measure_run, corpus_files, min_freq, False)
+            run["stages"] = run_in_process(measure_run, corpus_files, min_freq, True)["stages"]
+        finally:
+            shutil.rmtree(corpus_files)
+        run.update({"trees": n_trees, "corpus_bytes": corpus_bytes, "trees_per_sec": n_trees / run["seconds"]})
+        results["runs"].append(run)
+        print("{}\t{:.2f}\t{:.0f}\t{:.1f}\t{}".format(n_trees, run["seconds"], run["trees_per_sec"], run["peak_rss_mb"],
+                                                   "\t".join("{:.2f}".format(run["stages"][stage]) for stage in ("parse", "clean", "count", "score", "write"))))
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def bench_compare(old_path, new_path):
+    '''Compare two result files of bench_suite(), by corpus size
+    :param old_path: string with the path to the JSON results of the earlier run
+    :param new_path: string with the path to the JSON results of the later run
+    '''
+    with open(old_path) as f:
+        old_runs = dict((run["trees"], run) for run in json.load(f)["runs"])
+    with open(new_path) as f:
+        new_runs = dict((run["trees"], run) for run in json.load(f)["runs"])
+    print("trees\told_trees/sec\tnew_trees/sec\tspeedup\told_peak_mb\tnew_peak_mb")
+    for n_trees in sorted(set(old_runs) & set(new_runs)):
+        old, new = old_runs[n_trees], new_runs[n_trees]
+        print("{}\t{:.0f}\t{:.0f}\t{:.2f}\t{:.1f}\t{:.1f}".format(n_trees, old["trees_per_sec"], new["trees_per_sec"],
+                                                            new["trees_per_sec"] / old["trees_per_sec"], old["peak_rss_mb"], new["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+
+    user_args = sys.argv[1:]
+    if len(user_args) < 1:
+        sys.exit("To use script, specify minimum the path to corpus files")
+    if user_args[0] == "reader":
+        bench_reader(user_args[1])
+    elif user_args[0] == "cache":
+        bench_cache(user_args[1])
+    elif user_args[0] == "memory":
+        bench_memory(user_args[1])
+    elif user_args[0] == "clean":
+        bench_clean(user_args[1])
+    elif user_args[0] == "sketch":
+        bench_sketch(user_args[1], int(user_args[2]) if len(user_args) > 2 else 5, [float(x) for x in user_args[3:]] or (1, 4, 16))
+    elif user_args[0] == "generate":
+        generate_corpus(user_args[1], int(user_args[2]), seed=int(user_args[3]) if len(user_args) > 3 else 0)
+    elif user_args[0] == "suite":
+        bench_suite(user_args[1], [int(x) for x in user_args[2:]] or (10000, 100000, 1000000))
+    elif user_args[0] == "compare":
+        bench_compare(user_args[1], user_args[2])
+    else:
+        max_workers = int(user_args[1]) if len(user_args) > 1 else os.cpu_count()
+        bench_workers(user_args[0], max_workers)
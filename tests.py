@@ -1,7 +1,50 @@
+import glob
+import gzip
+import json
+import os
+import pstats
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
 import unittest
+import zipfile
 import treenet as tnt
 
 
+# small corpus in the Penn-Helsinki layout, one tab indentation for sentence level constituents
+test_trees = ["( (IP-MAT (ADVP-TMP (ADV Thenne))\n\t(BED was)\n\t(NP-SBJ (D the) (N kyng))\n\t(ADJP (ADVR wonderly) (ADJ wroth))\n\t(. .))\n\t(ID CMMALORY,{}.1))\n",
+              "( (IP-MAT (NP-SBJ (PRO he))\n\t(VBD seyde)\n\t(PP (P to) (NP (PRO hem)))\n\t(. .))\n\t(ID CMMALORY,{}.2))\n",
+              "( (IP-MAT (CONJ and)\n\t(NP-SBJ (PRO he))\n\t(VBD wente)\n\t(. .))\n\t(ID CMMALORY,{}.3))\n"]
+
+
+def write_test_corpus(folder, file_names=("cmmalory.m4", "cmkempe.m4", "cmsiege.m4")):
+    for i, file_name in enumerate(file_names):
+        with open(os.path.join(folder, file_name + ".psd"), "w") as f:
+            for j in range(3):
+                for tree in test_trees[:i + 2]:
+                    f.write(tree.format(i * 10 + j))
+                    f.write("\n")
+
+
+def read_output(folder, kind):
+    with open(glob.glob(os.path.join(folder, "treenet_{}_*.txt".format(kind)))[0]) as f:
+        return f.read()
+
+
+class CorpusTestCase(unittest.TestCase):
+    '''Tests that run on the test corpus, written to the "corpus" folder in the temporary folder self.tmp'''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.corpus = os.path.join(self.tmp, "corpus")
+        os.mkdir(self.corpus)
+        write_test_corpus(self.corpus)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
 class TestRemovePhraseDetails(unittest.TestCase):
     def runTest(self):
         self.assertEqual(tnt.remove_phrase_details('NP-SBJ-1-D-N'), 'NP-SBJ', 'Phrase simplification test assertion failed')
@@ -23,6 +66,15 @@ class TestCleanElementsBroad(unittest.TestCase):
         wo_list_test = ["(IP-MAT (ADVP-TMP (ADV Thenne)", "(BED was)", "(NP-SBJ (D the) (N kyng))", "(ADJP (ADVR wonderly) (ADJ wroth))"]
         self.assertEqual(" ".join(tnt.clean_elements(wo_list_test)[1]), "ADVP-TMP BE NP-SBJ ADJP", "Broad pattern extraction failed")
 
+class TestCleanElementsConjuncts(unittest.TestCase):
+    def runTest(self):
+        # a coordinated matrix clause: the conjuncts are whole IP-MAT constituents, not the opening line of a tree
+        tree = ("( (IP-MAT (IP-MAT-1 (NP-SBJ (PRO he))\n\t\t(VBD seyde))\n\t(CONJP (CONJ and)\n\t\t(IP-MAT-2 (NP-SBJ (PRO he)) (VBD wente)))\n\t(. .))\n"
+                "\t(ID CMMALORY,1.1))\n")
+        tree_id, wo_list = next(tnt.iter_trees(tree.splitlines(True)))
+        self.assertEqual(tnt.clean_elements(wo_list), (["IP-MAT-n"], ["IP-MAT"]), "Coordinated clause pattern extraction failed")
+        self.assertEqual(tnt.clean_elements(["(IP-MAT-1 (NP-SBJ (PRO he)) (VBD seyde))", "(VBD seyde)"])[0], ["IP-MAT-n", "VBD"], "Conjunct label test assertion failed")
+
 class TestCalcRelFreq(unittest.TestCase):
     def runTest(self):
         x = "a b c"
@@ -42,6 +94,385 @@ class TestCalcCorrelation(unittest.TestCase):
         v = {'a': 2, 'b': 3, 'c': 4}
         # round(log(0.5/(2/20 * 3/20 * 4/20)), 2)
         self.assertEqual(round(tnt.calculate_cx_total_correlation(x, y, z, w, v)[1], 2), 5.12, 'Correlation calculation failed')
+        self.assertEqual(tnt.get_total_correlation(v, {x: y}, py_version=3), tnt.get_total_correlation(v, {x: y}), 'Correlation with py_version test assertion failed')
         
-        
-unittest.main()
\ No newline at end of file
+
+
+class TestCleanElementsCache(unittest.TestCase):
+    def runTest(self):
+        wo_list_test = ["(NP-SBJ (PRO he))", "(VBD seyde)", "(VP (VBD seyde))", "(CODE <P_1>)"]
+        before = tnt.clean_elements_cache_info()
+        first = tnt.clean_elements(wo_list_test)
+        second = tnt.clean_elements(wo_list_test)
+        after = tnt.clean_elements_cache_info()
+        self.assertEqual(first, second, 'Memoised element cleaning changed the result')
+        self.assertEqual(" ".join(second[1]), "NP-SBJ VB VB", 'Memoised element cleaning failed')
+        self.assertGreaterEqual(after["hits"] - before["hits"], 2, 'Element memo cache was not used')
+        tnt.clean_elements(["(NP-SBJ (D the) (N kyng))"])
+        before = tnt.clean_elements_cache_info()
+        self.assertEqual(tnt.clean_elements(["(NP-SBJ (D the)\n\t\t(N quene))"])[0], ["NP-SBJ-D-N"], 'Element signature test assertion failed')
+        self.assertEqual(tnt.clean_elements_cache_info()["hits"] - before["hits"], 1, 'Elements that only differ in their words should share a memo cache entry')
+        self.assertIsNone(tnt.element_rules["CODE"], 'Compiled element rule test assertion failed')
+
+
+@unittest.skipIf(tnt.np is None, "NumPy is not installed")
+class TestVectorizedCorrelation(unittest.TestCase):
+    def runTest(self):
+        v = {'a': 2, 'b': 3, 'c': 4, 'd': 1}
+        cx_counts = {"a b c": 5, "b d": 3, "a b c d a b c d": 1, "c a": 0}
+        expected = tnt.get_total_correlation(v, cx_counts)
+        result = tnt.get_total_correlation_vectorized(v, cx_counts, chunk_size=3)
+        self.assertEqual(list(result), list(expected), 'Vectorized correlation changed the pattern order')
+        for k in cx_counts:
+            self.assertAlmostEqual(result[k][0], expected[k][0], msg='Vectorized relative frequency calculation failed')
+            if expected[k][1] is None:
+                self.assertIsNone(result[k][1], 'Vectorized correlation of zero frequency failed')
+            else:
+                self.assertAlmostEqual(result[k][1], expected[k][1], msg='Vectorized correlation calculation failed')
+        self.assertIsNone(tnt.get_total_correlation_vectorized(v, {"a x": 2})["a x"][1], 'Vectorized correlation of unknown element failed')
+
+
+class TestIterTrees(unittest.TestCase):
+    def runTest(self):
+        lines = ["( (CODE {COM:preface})\n", "  (ID CMMALORY,1.0))\n", "\n",
+                 "( (IP-MAT (NP-SBJ (PRO he))\n", "          (VBD seyde)\n",
+                 "          (PP (P to)\n", "              (NP (PRO hem)))\n", "          (. .))\n",
+                 "  (ID CMMALORY,1.1))\n"]
+        trees = list(tnt.iter_trees(lines))
+        self.assertEqual(trees, [("CMMALORY,1.1", ["(NP-SBJ (PRO he))", "(VBD seyde)", "(PP (P to)\n              (NP (PRO hem)))", "(. .)"])],
+                         'Tree reader test assertion failed')
+
+
+class TestCleanElementsConstituents(unittest.TestCase):
+    def runTest(self):
+        wo_list_test = ["(NP-SBJ (PRO he))", "(VBD seyde)", "(NP-OB1 (D the) (N wordes) (PP (P of) (NP (NPR Merlin))))", "(. .)"]
+        self.assertEqual(" ".join(tnt.clean_elements(wo_list_test)[0]), "NP-SBJ-PRO VBD NP-OB1-D-N-PP", "Constituent pattern extraction failed")
+
+
+class TestCorpusSources(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        file_names = sorted(os.listdir(self.corpus))
+        # the same files compressed, in a sub-folder, and in zip and tar archives
+        self.compressed = os.path.join(self.tmp, "compressed")
+        os.makedirs(os.path.join(self.compressed, "more"))
+        for file_name, suffix in zip(file_names, (".gz", ".bz2", ".xz")):
+            folder = self.compressed if suffix == ".gz" else os.path.join(self.compressed, "more")
+            with open(os.path.join(self.corpus, file_name), 'rb') as f, tnt.compressed_openers[suffix](os.path.join(folder, file_name + suffix), 'wb') as out:
+                out.write(f.read())
+        self.zip = os.path.join(self.tmp, "corpus.zip")
+        with zipfile.ZipFile(self.zip, 'w') as archive:
+            for file_name in file_names:
+                archive.write(os.path.join(self.corpus, file_name), "psd/" + file_name)
+        self.tar = os.path.join(self.tmp, "corpus.tar.gz")
+        with tarfile.open(self.tar, 'w:gz') as archive:
+            for file_name in reversed(file_names):
+                archive.add(os.path.join(self.corpus, file_name), file_name)
+
+    def runTest(self):
+        self.assertEqual([tnt.corpus_file_name(file) for file in tnt.find_corpus_files(self.zip)], ["cmkempe.m4", "cmmalory.m4", "cmsiege.m4"],
+                         'Archive members test assertion failed')
+        outputs = []
+        for i, (source, workers) in enumerate([(self.corpus, 1), (self.compressed, 1), (self.zip, 2), (self.tar, 1)]):
+            out = os.path.join(self.tmp, "out{}".format(i))
+            os.mkdir(out)
+            tnt.get_constructions(source, out, min_freq=1, workers=workers)
+            outputs.append((read_output(out, "aggregated"), read_output(out, "full_data")))
+        for output in outputs[1:]:
+            self.assertEqual(output, outputs[0], 'Compressed or archived corpus test assertion failed')
+        self.assertEqual(list(tnt.read_ahead(iter([b"a", b"b", b""]).__next__, 1)), [b"a", b"b"], 'Read ahead test assertion failed')
+        # mistyped paths and files that are not corpus files are not read
+        with open(os.path.join(self.tmp, "notes.txt"), 'w') as f:
+            f.write("( (IP-MAT (NP-SBJ (PRO he)) (VBD seyde)) (ID NOTES,1))\n")
+        self.assertEqual(tnt.find_corpus_files([os.path.join(self.tmp, "missing"), os.path.join(self.tmp, "missing.zip"), os.path.join(self.tmp, "notes.txt")]), [],
+                         'Missing corpus files test assertion failed')
+        with self.assertRaises(SystemExit):
+            tnt.get_constructions(os.path.join(self.tmp, "missing"), self.tmp)
+
+
+class TestParallelExtraction(CorpusTestCase):
+    def runTest(self):
+        outputs = []
+        for workers in (1, 2):
+            out = os.path.join(self.tmp, "out{}".format(workers))
+            os.mkdir(out)
+            tnt.get_constructions(self.corpus, out, min_freq=1, workers=workers)
+            outputs.append((read_output(out, "aggregated"), read_output(out, "full_data")))
+        self.assertEqual(outputs[0], outputs[1], 'Parallel extraction differs from serial extraction')
+        self.assertIn("ADVP-TMP BED NP-SBJ-D-N ADJP", outputs[0][0], 'Parallel extraction test assertion failed')
+
+
+class TestCountCache(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = os.path.join(self.tmp, "cache")
+
+    def entry_mtimes(self, parsed_files):
+        return [os.stat(tnt.cache_entry_path(self.cache, file)).st_mtime_ns for file in parsed_files]
+
+    def runTest(self):
+        parsed_files = sorted(glob.glob(os.path.join(self.corpus, "*.psd")))
+        cold = tnt.extract_corpus(parsed_files, cache_dir=self.cache)
+        cold_mtimes = self.entry_mtimes(parsed_files)
+        self.assertEqual(tnt.extract_corpus(parsed_files, cache_dir=self.cache).cx_count_dict(), cold.cx_count_dict(), 'Cached counts differ from extracted counts')
+        self.assertEqual(self.entry_mtimes(parsed_files), cold_mtimes, 'Unchanged files were extracted again')
+
+        with open(parsed_files[0], "a") as f:
+            f.write(test_trees[0].format(99))
+        self.assertEqual(tnt.extract_corpus(parsed_files, cache_dir=self.cache).sent_count["cmkempe.m4"], 10, 'Changed file was not extracted again')
+        self.assertEqual(self.entry_mtimes(parsed_files)[1:], cold_mtimes[1:], 'Only the changed file should be extracted again')
+
+        os.remove(parsed_files[1])
+        tnt.extract_corpus([parsed_files[0], parsed_files[2]], cache_dir=self.cache)
+        self.assertEqual(len(glob.glob(os.path.join(self.cache, "*.pickle"))), 2, 'Cache entry of deleted file was not removed')
+        self.assertEqual(len(glob.glob(os.path.join(self.cache, "*.spill"))), 2, 'Instance spill file of deleted file was not removed')
+
+        # the cache folder given relative to another working folder, and an instance spill file removed by hand
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.tmp)
+            relative_cache = "relative_cache"
+            tnt.extract_corpus([parsed_files[0], parsed_files[2]], cache_dir=relative_cache)
+            os.chdir(self.corpus)
+            relative_cache = os.path.join("..", "relative_cache")
+            self.assertEqual(len(list(tnt.iter_instances(tnt.extract_corpus([parsed_files[0], parsed_files[2]], cache_dir=relative_cache)))), 19,
+                             'Cached instances from another working folder test assertion failed')
+            os.remove(tnt.spill_file_path(0, parsed_files[2], relative_cache))
+            self.assertFalse(tnt.is_cached(relative_cache, parsed_files[2], tnt.extractor_fingerprint()), 'Missing spill file test assertion failed')
+            self.assertEqual(len(list(tnt.iter_instances(tnt.extract_corpus([parsed_files[0], parsed_files[2]], cache_dir=relative_cache)))), 19,
+                             'Instances after a missing spill file test assertion failed')
+        finally:
+            os.chdir(cwd)
+
+        # a changed pattern for reading the trees drops the cached counts
+        fingerprint = tnt.extractor_fingerprint()
+        tree_id_re = tnt.tree_id_re
+        try:
+            tnt.tree_id_re = re.compile(tree_id_re.pattern.replace("ID", "ID-?"))
+            self.assertNotEqual(tnt.extractor_fingerprint(), fingerprint, 'Fingerprint of the tree patterns test assertion failed')
+        finally:
+            tnt.tree_id_re = tree_id_re
+
+
+class TestMergeCountStates(unittest.TestCase):
+    def runTest(self):
+        a = tnt.CountState()
+        a.add_tree(["NP-SBJ", "VBD"], ["NP-SBJ", "VB"])
+        a.add_tree(["NP-SBJ", "VBD"], ["NP-SBJ", "VB"])
+        b = tnt.CountState()
+        b.add_tree(["ADVP", "VBD", "NP-SBJ"], ["ADVP", "VB", "NP-SBJ"])
+        b.add_tree(["NP-SBJ", "VBD"], ["NP-SBJ", "VB"])
+        merged = tnt.CountState().merge(a).merge(b)
+        self.assertEqual(merged.cx_count_dict(), {"NP-SBJ VBD": 3, "ADVP VBD NP-SBJ": 1}, 'Merged counts test assertion failed')
+        self.assertEqual(merged.elements_global_count(), {"NP-SBJ": 4, "VBD": 4, "ADVP": 1}, 'Merged element counts test assertion failed')
+        row = merged.patterns.index[merged.vocab.encode(["NP-SBJ", "VBD"])]
+        self.assertEqual(merged.vocab.decode(merged.patterns.broad_patterns[merged.patterns.broad[row]]), "NP-SBJ VB", 'Merged broad pattern test assertion failed')
+
+
+class TestFullDataInstances(CorpusTestCase):
+    def runTest(self):
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=7, compress=True)
+        with gzip.open(glob.glob(os.path.join(self.tmp, "treenet_full_data_*.txt.gz"))[0], "rt") as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        self.assertEqual(rows[0][4:], ["id", "file", "year", "genre", "dialect"], 'Full data header test assertion failed')
+        # the two patterns in every file occur three times per file, the third one only in two files and is pruned
+        self.assertEqual(len(rows) - 1, 18, 'Every occurrence should have its own row')
+        self.assertEqual(rows[1][4:], ["CMMALORY,10.1", "cmkempe.m4", "1450", "Religious Treatise", "East Midlands"], 'Full data metadata test assertion failed')
+        self.assertEqual(len(set(row[4] for row in rows[1:])), 18, 'Occurrence ids should all differ')
+
+
+class TestTreeIndex(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index_dir = os.path.join(self.tmp, "index")
+
+    def runTest(self):
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=7, index_dir=self.index_dir)
+        with tnt.open_index(self.index_dir) as index:
+            trees = index.lookup("ADVP-TMP BED NP-SBJ-D-N ADJP")
+            self.assertEqual(len(trees), 9, 'Index lookup test assertion failed')
+            self.assertEqual(trees[0], ("CMMALORY,10.1", "cmkempe.m4"), 'Index lookup order test assertion failed')
+            self.assertEqual(len(index.lookup("ADVP-TMP BE NP-SBJ ADJP", broad=True)), 9, 'Broad index lookup test assertion failed')
+            self.assertEqual(index.containing("BED"), ["ADVP-TMP BED NP-SBJ-D-N ADJP"], 'Index containing test assertion failed')
+            # the index covers the patterns pruned from the output as well
+            self.assertEqual(len(index.containing("NP-SBJ", broad=True)), 3, 'Broad index containing test assertion failed')
+            self.assertEqual(index.lookup("NP-SBJ NP-SBJ"), [], 'Missing pattern test assertion failed')
+            self.assertEqual(index.containing("XYZ"), [], 'Missing element test assertion failed')
+        # the arrays are little-endian on every platform, e.g. the last tree offset is the size of the tree table
+        with open(os.path.join(self.index_dir, "trees.off"), "rb") as f:
+            f.seek(-8, os.SEEK_END)
+            self.assertEqual(struct.unpack('<Q', f.read())[0], os.path.getsize(os.path.join(self.index_dir, "trees.str")),
+                             'Little-endian index test assertion failed')
+
+
+class TestRunMetrics(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        # a tree with a single element, which is dropped, and one with an empty VP, which is skipped
+        with open(os.path.join(self.corpus, "cmsiege.m4.psd"), "a") as f:
+            f.write("( (IP-MAT (NP-SBJ (PRO he))\n\t(. .))\n\t(ID CMSIEGE,1.1))\n\n")
+            f.write("( (IP-MAT (NP-SBJ (PRO he))\n\t(VBD seyde)\n\t(VP)\n\t(. .))\n\t(ID CMSIEGE,1.2))\n")
+
+    def runTest(self):
+        events = []
+        metrics_path = os.path.join(self.tmp, "metrics.json")
+        profile_path = os.path.join(self.tmp, "profile.prof")
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=1, progress=lambda event, metrics: events.append(event),
+                              metrics_path=metrics_path, profile_path=profile_path)
+        self.assertEqual(events, ["file", "file", "file", "extract", "score", "write"], 'Progress events test assertion failed')
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        self.assertEqual((metrics["trees_seen"], metrics["trees_kept"], metrics["trees_dropped"]), (26, 25, 1), 'Tree counters test assertion failed')
+        self.assertEqual(metrics["constituents_skipped"], 1, 'Skipped constituent counter test assertion failed')
+        self.assertEqual(sorted(metrics["stages"]["write"]), ["cpu", "wall"], 'Stage timer test assertion failed')
+        self.assertTrue(pstats.Stats(profile_path).total_calls > 0, 'Profile dump test assertion failed')
+
+
+class TestFacets(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        # the West Midlands files on their own
+        self.slice = os.path.join(self.tmp, "slice")
+        os.mkdir(self.slice)
+        for file_name in ("cmmalory.m4.psd", "cmsiege.m4.psd"):
+            shutil.copy(os.path.join(self.corpus, file_name), self.slice)
+        self.out = os.path.join(self.tmp, "out")
+        self.out_slice = os.path.join(self.tmp, "out_slice")
+        os.mkdir(self.out)
+        os.mkdir(self.out_slice)
+
+    def runTest(self):
+        tnt.get_constructions(self.corpus, self.out, min_freq=2, facets=["dialect", "period"])
+        tnt.get_constructions(self.slice, self.out_slice, min_freq=2)
+        rows = [line.split("\t", 2) for line in read_output(self.out, "facets").splitlines()[1:]]
+        self.assertEqual(sorted(set((row[0], row[1]) for row in rows)), [("dialect", "East Midlands"), ("dialect", "West Midlands"), ("period", "m4")],
+                         'Facet values test assertion failed')
+        west_midlands = sorted(row[2] for row in rows if row[1] == "West Midlands")
+        self.assertEqual(west_midlands, sorted(read_output(self.out_slice, "aggregated").splitlines()[1:]), 'Facet scores test assertion failed')
+        # all the files are from the same period
+        period = sorted(row[2] for row in rows if row[0] == "period")
+        self.assertEqual(period, sorted(read_output(self.out, "aggregated").splitlines()[1:]), 'Single facet value test assertion failed')
+
+
+class TestSnapshots(CorpusTestCase):
+
+    def outputs(self, folder):
+        with gzip.open(glob.glob(os.path.join(folder, "treenet_full_data_*.txt.gz"))[0], "rt") as f:
+            return read_output(folder, "aggregated"), read_output(folder, "facets"), f.read()
+
+    def runTest(self):
+        files = sorted(glob.glob(os.path.join(self.corpus, "*.psd")))
+        single, merged, grouped = [os.path.join(self.tmp, name) for name in ("single", "merged", "grouped")]
+        for folder in (single, merged, grouped):
+            os.mkdir(folder)
+        tnt.get_constructions(self.corpus, single, min_freq=2, compress=True, facets=["dialect"])
+        # shards that are not contiguous in corpus order
+        snapshots = [os.path.join(self.tmp, name) for name in ("a.snap", "b.snap")]
+        tnt.write_snapshot([files[0], files[2]], snapshots[0])
+        tnt.write_snapshot([files[1]], snapshots[1])
+        tnt.merge_constructions(snapshots[::-1], merged, min_freq=2, compress=True, facets=["dialect"])
+        self.assertEqual(self.outputs(merged), self.outputs(single), 'Snapshot merge test assertion failed')
+        # merging in stages gives the same results
+        tnt.merge_snapshots(snapshots, os.path.join(self.tmp, "ab.snap"))
+        tnt.merge_constructions([os.path.join(self.tmp, "ab.snap")], grouped, min_freq=2, compress=True, facets=["dialect"])
+        self.assertEqual(self.outputs(grouped), self.outputs(single), 'Hierarchical snapshot merge test assertion failed')
+        with self.assertRaises(ValueError):
+            tnt.merge_snapshots([snapshots[1], os.path.join(self.tmp, "ab.snap")], os.path.join(self.tmp, "bad.snap"))
+
+
+class TestSketchMode(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exact = os.path.join(self.tmp, "exact")
+        self.approximate = os.path.join(self.tmp, "approximate")
+        os.mkdir(self.exact)
+        os.mkdir(self.approximate)
+
+    def runTest(self):
+        sketch = tnt.CountMinSketch(0.0001)
+        patterns = ["NP-SBJ VBD", "NP-SBJ VBD PP", "ADVP-TMP BED NP-SBJ ADJP"] * 3 + ["NP-SBJ VBD"] * 4
+        for pattern in patterns:
+            sketch.add(pattern)
+        for pattern in set(patterns):
+            self.assertTrue(sketch.estimate(pattern) >= patterns.count(pattern), 'Sketch estimate test assertion failed')
+        tnt.get_constructions(self.corpus, self.exact, min_freq=7)
+        tnt.get_constructions(self.corpus, self.approximate, min_freq=7, sketch_mb=0.0001)
+        for kind in ("aggregated", "full_data"):
+            self.assertEqual(read_output(self.approximate, kind), read_output(self.exact, kind), 'Approximate mode test assertion failed')
+
+
+class TestSubpatterns(CorpusTestCase):
+    def runTest(self):
+        # each sequence only counts once, however often the sub-sequence occurs in it
+        self.assertEqual(sorted(tnt.mine_contiguous([(1, 2, 1, 2), (2, 1)], [3, 2], 2)), [((1, 2), 3), ((1, 2, 1), 3), ((1, 2, 1, 2), 3), ((2, 1), 5), ((2, 1, 2), 3)],
+                         'Contiguous mining test assertion failed')
+        self.assertEqual(sorted(tnt.mine_gapped([(1, 3, 2), (1, 2)], [3, 2], 4)), [((1, 2), 5)], 'Gapped mining test assertion failed')
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=5, subpatterns=True)
+        rows = dict(((row[0], row[1], row[2]), row[3:]) for row in (line.split("\t") for line in read_output(self.tmp, "subpatterns").splitlines()[1:]))
+        self.assertEqual(rows[("contiguous", "narrow", "NP-SBJ-PRO VBD")][0], "15", 'Contiguous sub-pattern test assertion failed')
+        self.assertEqual(rows[("gapped", "broad", "ADVP-TMP NP-SBJ")][0], "9", 'Gapped sub-pattern test assertion failed')
+        self.assertTrue(("contiguous", "broad", "ADVP-TMP NP-SBJ") not in rows, 'Gap in contiguous sub-pattern test assertion failed')
+
+
+class TestSignificance(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spill = os.path.join(self.tmp, "spill")
+        os.mkdir(self.spill)
+
+    def runTest(self):
+        state = tnt.extract_corpus(sorted(glob.glob(os.path.join(self.corpus, "*.psd"))), spill_dir=self.spill)
+        rows = list(range(len(state.patterns)))
+        scores = tnt.get_state_total_correlation(state, rows)
+        for resample in ("trees", "files"):
+            serial = tnt.bootstrap_significance(state, rows, 250, resample=resample, seed=3)
+            # the blocks of replicates are seeded on their own, so the workers draw the same replicates
+            self.assertEqual(serial, tnt.bootstrap_significance(state, rows, 250, resample=resample, seed=3, workers=2),
+                             'Significance workers test assertion failed')
+            for (rel_freq, total_corr), (ci_low, ci_high, p_value) in zip(scores, serial):
+                # with three files, resampling files often leaves a pattern out, which has no lower bound
+                if resample == "trees":
+                    self.assertTrue(ci_low <= total_corr <= ci_high, 'Confidence interval test assertion failed')
+                self.assertTrue(1.0 / 251 <= p_value <= 1, 'P-value test assertion failed')
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=2, replicates=50)
+        lines = read_output(self.tmp, "aggregated").splitlines()
+        self.assertEqual(lines[0].split("\t")[-3:], ["ci_low", "ci_high", "p_value"], 'Significance columns test assertion failed')
+        self.assertEqual(len(lines[1].split("\t")), 8, 'Significance values test assertion failed')
+
+
+class TestClauseTypes(CorpusTestCase):
+    def setUp(self):
+        super().setUp()
+        # a subordinate clause inside a matrix clause
+        with open(os.path.join(self.corpus, "cmkempe.m4.psd"), "a") as f:
+            for j in range(2):
+                f.write("( (IP-MAT (NP-SBJ (PRO he))\n\t(VBD seyde)\n\t(CP-THT (C that)\n\t\t(IP-SUB (NP-SBJ (D the) (N kyng)) (BED was) (ADJP (ADJ wroth))))\n"
+                        "\t(. .))\n\t(ID CMKEMPE,{}.4))\n\n".format(j))
+                # a relative clause inside the subject
+                f.write("( (IP-MAT (NP-SBJ (D the) (N man)\n\t\t(CP-REL (WNP-1 0) (C that) (IP-SUB (NP-SBJ *T*-1) (VBD cam))))\n\t(VBD wente)\n"
+                        "\t(. .))\n\t(ID CMKEMPE,{}.5))\n\n".format(j))
+
+    def runTest(self):
+        tree_id, clauses = tnt.parse_clauses("( (IP-MAT-SPE (NP-SBJ (PRO he)) (VBD seyde) (CP-THT (C that) (IP-SUB (PRO he) (VBD wente)))) (ID A,1))",
+                                             tnt.clause_label_re(["IP", "IP-MAT"]))
+        self.assertEqual([label for label, constituents in clauses], ["IP-MAT", "IP"], 'Clause labels test assertion failed')
+        parsed_files = sorted(glob.glob(os.path.join(self.corpus, "*.psd")))
+        # top level IP-MAT trees are counted the same as without clause types
+        self.assertEqual(tnt.extract_corpus(parsed_files, clauses=["IP-MAT"]).states[0].cx_count_dict(), tnt.extract_corpus(parsed_files).cx_count_dict(),
+                         'Matrix clause counts test assertion failed')
+        tnt.get_constructions(self.corpus, self.tmp, min_freq=2, clauses=["IP-MAT", "IP-SUB", "CP-REL"])
+        rows = [line.split("\t") for line in read_output(self.tmp, "aggregated").splitlines()]
+        self.assertEqual(rows[0][:2], ["clause_type", "cx_broad"], 'Clause type column test assertion failed')
+        self.assertEqual([row[:4] for row in rows if row[0] == "IP-SUB"], [["IP-SUB", "NP-SBJ BE ADJP", "NP-SBJ-D-N BED ADJP", "2"],
+                                                                          ["IP-SUB", "NP-SBJ VB", "NP-SBJ-*T*-n VBD", "2"]],
+                         'Subordinate clause test assertion failed')
+        # the subordinate clause is scored against the elements of subordinate clauses only
+        self.assertEqual(float([row for row in rows if row[0] == "IP-SUB"][0][4]), 0.5, 'Clause element totals test assertion failed')
+        # the wh-phrase and the complementiser of a relative clause are elements of its pattern
+        self.assertEqual([row[:4] for row in rows if row[0] == "CP-REL"], [["CP-REL", "WNP C IP-SUB", "WNP-n C IP-SUB", "2"]],
+                         'Relative clause test assertion failed')
+        self.assertIn("IP-MAT\tNP-SBJ VB CP-THT\tNP-SBJ-PRO VBD CP-THT\t", read_output(self.tmp, "full_data"), 'Clause full data test assertion failed')
+
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -4,13 +4,179 @@
 # version: 0.1 
 
 
+import argparse
+import array
+import bz2
+import collections
+import contextlib
+import cProfile
+import functools
 import glob
+import gzip
 import re
 import os
 import sys
+import hashlib
+import heapq
+import inspect
+import io
+import itertools
+import json
+import locale
+import lzma
+import mmap
+import multiprocessing
+import pickle
+import queue
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
 import math
 import time
 
+# NumPy is optional, it is only used to score all constructions at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+### Global constants for normalizing metadata 
+
+# ME data
+# dictionary of files and dialects
+me_dialects = {"cmkentho.m1" : "Kentish", "cmpeterb.m1" : "East Midlands", "cmorm.po.m1" : "East Midlands", "cmvices1.m1" : "East Midlands", "cmtrinit.mx1" : "East Midlands", 
+"cmlambx1.mx1" : "West Midlands", "cmlamb1.m1" : "West Midlands", "cmsawles.m1" : "West Midlands", "cmhali.m1" : "West Midlands", "cmkathe.m1" : "West Midlands", "cmjulia.m1" : "West Midlands", "cmmarga.m1" : "West Midlands", "cmancriw-1.m1" : "West Midlands", "cmancriw-2.m1" : "West Midlands",
+"cmkentse.m2" : "Kentish", "cmayenbi.m2" : "Kentish", "cmearlps.m2" : "East Midlands", "cmaelr3.m23" : "West Midlands", "cmrolltr.m24" : "Northern", "cmrollep.m24" : "Northern",
+"cmpolych.m3" : "Southern", "cmntest.m3" : "Southern", "cmpurvey.m3" : "Southern", "cmhorses.m3" : "Southern", "cmroyal.m34" : "Southern",
+"cmctpars.m3" : "East Midlands", "cmctmeli.m3" : "East Midlands", "cmequato.m3" : "East Midlands", "cmwycser.m3" : "East Midlands", "cmboeth.m3" : "East Midlands", "cmotest.m3" : "East Midlands", "cmcloud.m3" : "East Midlands", "cmmandev.m3" : "East Midlands", "cmastro.m3" : "East Midlands", "cmhilton.m34" : "East Midlands", "cmvices4.m34" : "East Midlands", "cmjulnor.m34" : "East Midlands", "cmedvern.m3" : "West Midlands", "cmbrut3.m3" : "West Midlands", "cmmirk.m34" : "West Midlands", "cmbenrul.m3" : "Northern", "cmedthor.m34" : "Northern", "cmgaytry.m34" : "Northern",
+"cmgregor.m4" : "Southern", "cmaelr4.m4"  : "East Midlands", "cmedmund.m4" : "East Midlands", "cmkempe.m4" : "East Midlands", "cmcapser.m4" : "East Midlands", "cmcapchr.m4" : "East Midlands", "cmreynes.m4" : "East Midlands", "cmreynar.m4" : "East Midlands", "cmfitzja.m4" : "East Midlands", "cminnoce.m4": "East Midlands", "cmmalory.m4" : "West Midlands", "cmsiege.m4" : "West Midlands", "cmthorn.mx4" : "Northern"}
+
+# dicationary of MS dates   
+me_dates = {"cmkentho.m1" : 1125, "cmpeterb.m1" : 1150, "cmorm.po.m1" : 1200, "cmvices1.m1" : 1225, "cmtrinit.mx1" : 1225, 
+"cmlambx1.mx1" : 1225, "cmlamb1.m1" : 1225, "cmsawles.m1" : 1225, "cmhali.m1" : 1225, "cmkathe.m1" : 1225, "cmjulia.m1" : 1225, "cmmarga.m1" : 1225, "cmancriw-1.m1" : 1230, "cmancriw-2.m1" : 1230,
+"cmkentse.m2" : 1275, "cmayenbi.m2" : 1340, "cmearlps.m2" : 1350, "cmaelr3.m23" : 1400, "cmrolltr.m24" : 1440, "cmrollep.m24" : 1450,
+"cmpolych.m3" : 1387, "cmntest.m3" : 1388, "cmpurvey.m3" : 1388, "cmhorses.m3" : 1450, "cmroyal.m34" : 1450,
+"cmctpars.m3" : 1390, "cmctmeli.m3" : 1390, "cmequato.m3" : 1392, "cmwycser.m3" : 1400, "cmboeth.m3" : 1425, "cmotest.m3" : 1425, "cmcloud.m3" : 1425, "cmmandev.m3" : 1425, "cmastro.m3" : 1450, "cmhilton.m34" : 1450, "cmvices4.m34" : 1450, "cmjulnor.m34" : 1450, "cmedvern.m3" : 1390, "cmbrut3.m3" : 1400, "cmmirk.m34" : 1500, "cmbenrul.m3" : 1425, "cmedthor.m34" : 1440, "cmgaytry.m34" : 1440,
+"cmgregor.m4" : 1475, "cmaelr4.m4"  : 1450, "cmedmund.m4" : 1450, "cmkempe.m4" : 1450, "cmcapser.m4" : 1452, "cmcapchr.m4" : 1464, "cmreynes.m4" : 1485, "cmreynar.m4" : 1481, "cmfitzja.m4" : 1495, "cminnoce.m4": 1497, "cmmalory.m4" : 1470, "cmsiege.m4" : 1500, "cmthorn.mx4" : 1440}
+
+# dictionary of genres
+me_genres = {"cmkentho.m1" : "Homily", "cmpeterb.m1" : "History", "cmorm.po.m1" : "Homily", "cmvices1.m1" : "Religious Treatise", "cmtrinit.mx1" : "Homily", 
+"cmlambx1.mx1" : "Homily", "cmlamb1.m1" : "Homily", "cmsawles.m1" : "Homily", "cmhali.m1" : "Religious Treatise", "cmkathe.m1" : "Biography, Life of Saint", "cmjulia.m1" : "Biography, Life of Saint", 
+"cmmarga.m1" : "Biography, Life of Saint", "cmancriw-1.m1" : "Religious Treatise", "cmancriw-2.m1" : "Religious Treatise",
+"cmkentse.m2" : "Homily", "cmayenbi.m2" : "Religious Treatise", "cmearlps.m2" : "Bible", "cmaelr3.m23" : "Rule", "cmrolltr.m24" : "Religious Treatise", 
+"cmrollep.m24" : "Religious Treatise",
+"cmpolych.m3" : "History", "cmntest.m3" : "Bible", "cmpurvey.m3" : "Religious Treatise", "cmhorses.m3" : "Handbook", "cmroyal.m34" : "Sermon",
+"cmctpars.m3" : "Religious Treatise", "cmctmeli.m3" : "Fiction", "cmequato.m3" : "Handbook", "cmwycser.m3" : "Sermon", "cmboeth.m3" : "Philosophy", "cmotest.m3" : "Bible", 
+"cmcloud.m3" : "Religious Treatise", "cmmandev.m3" : "Travelogue", "cmastro.m3" : "Handbook", "cmhilton.m34" : "Religious Treatise", "cmvices4.m34" : "Religious Treatise", "cmjulnor.m34" : "Religious Treatise", 
+"cmedvern.m3" : "Religious Treatise", "cmbrut3.m3" : "History", "cmmirk.m34" : "Sermon", "cmbenrul.m3" : "Rule", "cmedthor.m34" : "Religious Treatise", "cmgaytry.m34" : "Sermon",
+"cmgregor.m4" : "History", "cmaelr4.m4"  : "Rule", "cmedmund.m4" : "Biography, Life of Saint", "cmkempe.m4" : "Religious Treatise", "cmcapser.m4" : "Sermon", "cmcapchr.m4" : "History", 
+"cmreynes.m4" : "Handbook", "cmreynar.m4" : "Fiction", "cmfitzja.m4" : "Sermon", "cminnoce.m4": "Sermon", "cmmalory.m4" : "Romance", "cmsiege.m4" : "Romance", 
+"cmthorn.mx4" : "Handbook"}
+
+
+
+# EME or ME period code at the end of a file name, e.g. m1, e2
+period_re = re.compile(r'.*?\.([em]\d\d?)$')
+
+# facets that the counts can be split by, see file_facets()
+facet_names = ("period", "genre", "dialect", "year")
+
+
+### Normalisation rules for clean_elements()
+
+# Map inflected variants to uninflected ones
+verb_elements = {"MD": "MD", "HVD": "HV", "HVP": "HV", "DOP": "DO", "DOD": "DO", "DO": "DO", "VAN": "VAN", 
+"VBP": "VB", "VBD": "VB", "VB": "VB", "NEG+VBP": "VB", 
+"NEG+VB": "VB", "NEG+VBD": "VB", "BEP": "BE", "BED": "BE", "BE": "BE", 
+"NEG+BE": "BE", "NEG+BEP": "BE", "NEG+BED": "BE"} 
+
+# elements that are not counted when they follow the IP-MAT tag on the same line
+ip_mat_excluded = ("LB", "LATIN", "LS", "META", "REF", "CODE", "QTP", "CONJ")
+
+# elements that are kept unchanged in both the narrow and broad patterns
+plain_elements = ("NEG", "RP", "Q", "FP", "ADV", "INTJ", "NUM", "W")
+
+# words that introduce a clause, e.g. (C that) in a CP or (TO to) in an IP-INF, kept unchanged like plain_elements
+clause_head_elements = ("C", "TO", "P", "FOR")
+
+# wh-phrases at the start of relative clauses and questions, e.g. (WNP-1 0) in a CP-REL
+wh_elements = ("WNP", "WADVP", "WPP", "WADJP", "WQP")
+
+# rules compiled from the tables above, by element label, see compile_element_rule()
+element_rules = {}
+
+# number of distinct element signatures memoised by clean_constituent(), see constituent_signature()
+element_cache_size = 100000
+
+# returned by clean_constituent() for elements that are too short to clean, e.g. "(VP)", so that they can be counted
+skipped_element = ()
+
+# the label at the start of an element, after the opening bracket
+element_head_re = re.compile(r'[(\s]*([^\s()]+)')
+# an opening bracket right inside another one, which is more than two levels deep after the first bracket, see top_tokens()
+nested_bracket_re = re.compile(r'\([^()]*\(')
+
+
+# tokens in a bracketed tree: brackets, tags and words
+tree_token_re = re.compile(r'[()]|[^\s()]+')
+# start of a matrix clause and of a tree ID
+ip_mat_re = re.compile(r'\(\s*IP-MAT[^\s()]*')
+tree_id_re = re.compile(r'\(\s*ID\s+([^\s()]+)\s*\)')
+# opening and closing brackets, see split_constituents()
+bracket_re = re.compile(r'[()]')
+
+
+# array typecode of the element IDs in a pattern key, see ElementVocabulary
+element_id_typecode = 'I'
+
+# number of rows written at a time to instance spill files and the full data output, see RowWriter
+row_batch_size = 10000
+
+# size of the blocks that compressed corpus files and archive members are read in, see open_corpus_lines()
+read_block_size = 1 << 20
+# number of blocks read ahead of the parser from compressed corpus files and archives, see read_ahead()
+read_ahead_blocks = 4
+# separator between the path of an archive and the name of a corpus file in it, e.g. "corpus.zip::psd/cmkempe.m4.psd"
+archive_member_sep = "::"
+# archives that corpus files are read from, see list_archive()
+archive_suffixes = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# extensions of compressed corpus files, with the function that opens a binary file object for reading decompressed.
+# Other compressions can be added here
+compressed_openers = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+# the archive opened last, by process, path, size and modification time, see open_archive()
+open_archives = {}
+
+# bump when the layout of the index files changes, see build_index()
+index_version = 1
+# byte order of the index arrays on every platform, see write_array() and map_array()
+index_byteorder = "little"
+
+# number of hash functions in the count-min sketch of the approximate mode, see CountMinSketch
+sketch_depth = 4
+
+# number of bootstrap replicates drawn from one seed, see bootstrap_significance()
+replicate_block_size = 100
+
+# confidence level of the bootstrap intervals
+confidence_level = 0.95
+
+# SignificanceModel of the current run in each process that draws replicates, see init_significance_worker()
+significance_model = None
+
+# bump when the layout of snapshot files changes, see write_snapshot()
+snapshot_version = 1
+# first bytes of a snapshot file
+snapshot_magic = b"TREENET-SNAPSHOT\n"
+# arrays of a file record in a snapshot, in the order they are written, with their array typecodes
+snapshot_arrays = (("element_counts", 'q'), ("narrow", element_id_typecode), ("narrow_lengths", 'I'), ("counts", 'q'),
+                   ("broad", 'q'), ("broad_patterns", element_id_typecode), ("broad_lengths", 'I'))
+
+# bump when the layout of the cached count states changes
+cache_version = 6
 
 
 ### Functions ###
@@ -37,82 +203,196 @@ def replace_coindex(x):
     return re.sub(r'-\d$', '-n', x)
 
 
-def clean_elements(element_list):
+def top_tokens(x):
+    '''Split a bracketed constituent into its label and the tokens of its immediate constituents
+    :param x: a string with a bracketed constituent, e.g. "(NP-SBJ (D the) (N kyng) (PP (P of) (NP (NPR Fraunce))))"
+    :return: a list of tags and words at the top two levels, e.g. ["NP-SBJ", "D", "the", "N", "kyng", "PP"]
+    '''
+    if x.startswith('(') and not nested_bracket_re.search(x, 1):
+        # most elements are only two levels deep, and all their tags and words are kept
+        return x.replace('(', ' ').replace(')', ' ').split()
+    depth = 0
+    tokens = []
+    for t in tree_token_re.findall(x):
+        if t == '(':
+            depth += 1
+        elif t == ')':
+            depth -= 1
+        elif depth <= 2:
+            tokens.append(t)
+    return tokens
+
+
+def compile_element_rule(head):
+    '''Work out how clean_elements() treats a sentence-level element from its label alone, see element_rules
+    :param head: string with the label of the element, e.g. "NP-SBJ" or "BED"
+    :return: a tuple with the narrow and broad cleaned element if the label decides the output, None if the element is
+     left out, or the name of the rule ("IP-MAT", "VP" or "NP") if the rest of the element is needed, see clean_constituent()
+    '''
+    if head.startswith("IP-MAT"):
+        #pick up any sentence level constiuents occurring directly after the IP-MAT* tag on the opening line of a tree.
+        #a whole IP-MAT* constituent, e.g. a conjunct, is cleaned like other IPs, see constituent_signature()
+        return "IP-MAT"
+    elif head == "PP":
+        #e_out = "-".join(e_split) # too noisy - used only PP for now
+        return head, head
+    elif head == "VP":
+        return "VP"
+    elif head in verb_elements:
+        return head, verb_elements.get(head, "VB")
+    elif head in plain_elements or head in clause_head_elements:
+        return head, head
+    elif head.split("-")[0] in wh_elements:
+        # co-indexed with the trace of the wh-phrase in the clause, e.g. WNP-1
+        return replace_coindex(head), head.split("-")[0]
+    elif head.startswith("IP"):
+        e_out = replace_coindex(head)
+        return e_out, remove_phrase_details(e_out)
+    elif head.startswith("CP"):
+        return head, remove_phrase_details(head)
+    elif head.startswith("RRP"):
+        return head, remove_phrase_details(head)
+    elif head.startswith("ADVP"):
+        e_out = replace_coindex(head)
+        return e_out, remove_phrase_details(e_out)
+    elif head.startswith("ADJP"):
+        e_out = replace_coindex(head)
+        return e_out, remove_phrase_details(e_out)
+    elif head.startswith("NP"):
+        # the most complex category, since we want to extract more information
+        return "NP"
+    else:
+        # do not include: CODE, foreign language passages like LATIN, META, quotations, and references
+        return None
+
+
+def constituent_signature(e, rule):
+    '''Reduce a sentence-level element to the tags and words that clean_constituent() depends on
+    :param e: string with the element, e.g. "(NP-SBJ (D the) (N kyng))"
+    :param rule: string with the name of the rule for the label of the element, see compile_element_rule()
+    :return: a tuple with the rule, and the first two tokens or, for NPs, whether there are more than two tokens at the
+     top two levels and the ones that are kept, e.g. ("NP", True, ("NP-SBJ", "D", "N")). None if the element is too short
+     to clean
+
+    Words that are left out of the output, e.g. "kyng" and "quene", are left out here too, so that elements that only
+    differ in their words share one entry of the memo cache.
+    '''
+    if rule == "NP":
+        # only the NP and its immediate constituents are used, not any phrases embedded further down
+        tokens = top_tokens(e)
+        if len(tokens) > 2:
+            return rule, True, tuple([t for t in tokens if t.isupper()])
+        return rule, False, tuple(tokens)
+    # Remove brackets, normalise white space, and split:
+    e_split = e.replace('(', '').replace(')', '').split(None, 2)
+    if rule == "IP-MAT" and e_split and e.count('(') <= e.count(')'):
+        # a whole matrix clause, e.g. a conjunct of a coordinated one, is cleaned like any other IP. Only the opening
+        # line of a tree, without its closing brackets, stands for its first constituent
+        return "IP", e_split[0]
+    if len(e_split) < 2:
+        return None
+    return rule, e_split[1]
+
+
+@functools.lru_cache(maxsize=element_cache_size)
+def clean_signature(signature):
+    '''Clean a sentence-level element from its signature, see constituent_signature() and clean_constituent()
+    :param signature: tuple from constituent_signature()
+    :return: a tuple with the narrow and broad cleaned element, or None if the element is left out
+    '''
+    e_out = ''
+    e_out_broad = ''
+    rule = signature[0]
+    if rule == "IP":
+        e_out = replace_coindex(signature[1])
+        e_out_broad = remove_phrase_details(e_out)
+    elif rule == "IP-MAT":
+        if signature[1] not in ip_mat_excluded:
+            e_out = replace_coindex(signature[1])
+            e_out_broad = remove_phrase_details(e_out)
+    elif rule == "VP":
+        e_out = signature[1]
+        e_out_broad = verb_elements.get(e_out, "VB")
+    elif rule == "NP":
+        more_tokens, tokens = signature[1:]
+        # a single token after the label is kept as it is, e.g. (NP-SBJ *exp*) -> NP-SBJ-*exp* (same for *con*)
+        if more_tokens or len(tokens) == 2:
+            e_out = "-".join([replace_coindex(e) for e in tokens])
+            e_out_broad = remove_phrase_details(e_out)
+    if e_out:
+        return e_out, e_out_broad
+    return None
+
+
+def clean_constituent(e, rule=None):
+    '''Clean a sentence-level element whose output depends on more than its label, see compile_element_rule()
+    :param e: string with the element, e.g. "(NP-SBJ (D the) (N kyng))"
+    :param rule: string with the name of the rule for the label of the element, e.g. "NP", when it is already known.
+     Defaults to None (looked up from the label)
+    :return: a tuple with the narrow and broad cleaned element, None if the element is left out, or skipped_element if
+     it is too short to clean
+
+    The results are memoised on the signature of the element, since the same tag combinations, e.g. "(NP-SBJ (PRO ...))",
+    recur throughout a corpus. See clean_elements_cache_info() for the hit rate.
+    '''
+    if rule is None:
+        head_match = element_head_re.match(e)
+        if not head_match:
+            return skipped_element
+        rule = compile_element_rule(head_match.group(1))
+        if rule.__class__ is not str:
+            return rule
+    signature = constituent_signature(e, rule)
+    if signature is None:
+        return skipped_element
+    return clean_signature(signature)
+
+
+def clean_elements_cache_info():
+    '''Statistics for the lookup tables used by clean_elements()
+    :return: a dict with the number of compiled element labels, and the hits, misses and size of the element memo cache
+    '''
+    cache_info = clean_signature.cache_info()
+    return {"labels": len(element_rules), "hits": cache_info.hits, "misses": cache_info.misses,
+            "maxsize": cache_info.maxsize, "currsize": cache_info.currsize}
+
+
+def clean_elements(element_list, counters=None):
     '''Clean a list of sentence-level elements
     :param element_list: a list of sentence level elements representing a single PPME2 parse tree
+    :param counters: dict where the number of elements that are too short to clean is added up under
+     "constituents_skipped", e.g. CountState.counters. Defaults to None (not counted)
     :return: a tuple with two lists of cleaned elements, one detailed, the other broader
     '''
-    # Map inflected variants to uninflected ones
-    v_elements_dict = {"MD": "MD", "HVD": "HV", "HVP": "HV", "DOP": "DO", "DOD": "DO", "DO": "DO", "VAN": "VAN", 
-    "VBP": "VB", "VBD": "VB", "VB": "VB", "NEG+VBP": "VB", 
-    "NEG+VB": "VB", "NEG+VBD": "VB", "BEP": "BE", "BED": "BE", "BE": "BE", 
-    "NEG+BE": "BE", "NEG+BEP": "BE", "NEG+BED": "BE"} 
     cleaned_list = []
     cleaned_list_broad = []
     
     for e in element_list:
-        # Remove brackets, normalise white space, and split:
-        e_no_brackets = e.replace('(', '').replace(')', '').replace('  ', ' ')
-        e_split = e_no_brackets.split()
-        e_out = ''
-        e_out_broad = ''
+        head_match = element_head_re.match(e)
+        if not head_match:
+            continue
+        head = head_match.group(1)
         try:
-            if e_split[0].startswith("IP-MAT"):
-                #pick up any sentence level constiuents occurring directly after the IP-MAT* tag
-                if e_split[1] not in ("LB", "LATIN", "LS", "META", "REF", "CODE", "QTP", "CONJ"):
-                    e_out = replace_coindex(e_split[1])
-                    e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0] == "PP":
-                #e_out = "-".join(e_split) # too noisy - used only PP for now
-                e_out = e_split[0]
-                e_out_broad = e_out
-            elif e_split[0] == "VP":
-                e_out = e_split[1]
-                e_out_broad = v_elements_dict.get(e_out, "VB")
-            elif e_split[0] in v_elements_dict.keys():
-                e_out = e_split[0]
-                e_out_broad = v_elements_dict.get(e_out, "VB")
-            elif e_split[0] in ("NEG", "RP", "Q", "FP", "ADV", "INTJ", "NUM", "W"):
-                e_out = e_split[0]
-                e_out_broad = e_out
-            elif e_split[0].startswith("IP"):
-                e_out = replace_coindex(e_split[0])
-                e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0].startswith("CP"):
-                e_out = e_split[0]
-                e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0].startswith("RRP"):
-                e_out = e_split[0]
-                e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0].startswith("ADVP"):
-                e_out = replace_coindex(e_split[0])
-                e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0].startswith("ADJP"):
-                e_out = replace_coindex(e_split[0])
-                e_out_broad = remove_phrase_details(e_out)
-            elif e_split[0].startswith("NP"):
-                # the most complex category, since we want to extract more information
-                if len(e_split) == 2:
-                    e_out = "-".join([replace_coindex(e) for e in e_split]) # e.g. (NP-SBJ *exp*) -> NP-SBJ-*exp* (same for *con*)
-                    e_out_broad = remove_phrase_details(e_out)
-                elif len(e_split) > 2:
-                    e_out = "-".join([replace_coindex(e) for e in e_split if e.isupper()])
-                    e_out_broad = remove_phrase_details(e_out)
-            else:
-                pass 
-                # do not include: CODE, foreign language passages like LATIN, META, quotations, and references
-            if e_out:
-                cleaned_list.append(e_out)
-                cleaned_list_broad.append(e_out_broad)
-        except IndexError:
-            pass
+            rule = element_rules[head]
+        except KeyError:
+            rule = element_rules[head] = compile_element_rule(head)
+        if rule is None:
+            continue
+        if rule.__class__ is not tuple:
+            rule = clean_constituent(e, rule)
+            if not rule:
+                if rule is skipped_element and counters is not None:
+                    counters["constituents_skipped"] += 1
+                continue
+        cleaned_list.append(rule[0])
+        cleaned_list_broad.append(rule[1])
 
     return cleaned_list, cleaned_list_broad   
 
 
 def calculate_cx_total_correlation(cx, freq, cx_totals_sum, elem_totals_sum, elem_totals_dict):
 
-    '''Total correlation as a variant of multivariate mutual information, see van de Cruys 2011 (ACL). Helper function for get_total_correlation() to handle Python 2 and 3  
+    '''Total correlation as a variant of multivariate mutual information, see van de Cruys 2011 (ACL). Helper function for get_total_correlation()
     :param cx construction
     :param freq: raw count of construction
     :cx_totals_sum: sum of all construction occurrences (token frequency)
@@ -120,11 +400,11 @@ def calculate_cx_total_correlation(cx, freq, cx_totals_sum, elem_totals_sum, ele
     :elem_totals_dict: dictionary mapping phrase elements to their global frequency
     :returns: a tuple with construction relative freq and construction total correlation
     '''
-    cx_prob = freq/float(cx_totals_sum) # convert to float to avoid integer division in Python 2.7
+    cx_prob = freq/cx_totals_sum
     my_elements = cx.split()
     my_elements_prob = []
     for e in my_elements:
-        my_element_prob = elem_totals_dict.get(e, 0)/float(elem_totals_sum) # convert to float to avoid integer division in Python 2.7
+        my_element_prob = elem_totals_dict.get(e, 0)/elem_totals_sum
         my_elements_prob.append(my_element_prob)
     
     total_element_prob = my_elements_prob[0]
@@ -143,6 +423,7 @@ def get_total_correlation(total_counts, cx_counts, py_version=3):
     '''Total correlation as a variant of multivariate mutual information, see van de Cruys 2011 (ACL)
     :param total_counts: dict with individual elements and their global counts
     :param cx_counts: dict with construction patterns and their counts
+    :param py_version: ignored, kept so that existing calls still work. TreeNet needs Python 3. Defaults to 3
     :returns: a dict with cx patterns (keys) and a tuple with relative frequency and total correlation scores (val)
     '''
     total_construction_count = sum(cx_counts.values())
@@ -150,252 +431,2369 @@ def get_total_correlation(total_counts, cx_counts, py_version=3):
     
     out_dict = {}
     
-    if py_version==3:
-        for k,v in cx_counts.items():
-            cx_rel_freq, cx_total_corr = calculate_cx_total_correlation(cx=k, freq=v, cx_totals_sum=total_construction_count, elem_totals_sum=total_element_counts, elem_totals_dict=total_counts)
-            out_dict[k] = cx_rel_freq, cx_total_corr
-                              
-    else:
-        for k,v in cx_counts.iteritems():
-            cx_rel_freq, cx_total_corr = calculate_cx_total_correlation(cx=k, freq=v, cx_totals_sum=total_construction_count, elem_totals_sum=total_element_counts, elem_totals_dict=total_counts)
-            out_dict[k] = cx_rel_freq, cx_total_corr
+    for k,v in cx_counts.items():
+        cx_rel_freq, cx_total_corr = calculate_cx_total_correlation(cx=k, freq=v, cx_totals_sum=total_construction_count, elem_totals_sum=total_element_counts, elem_totals_dict=total_counts)
+        out_dict[k] = cx_rel_freq, cx_total_corr
         
     return out_dict
 
-    
-# *Main function* 
 
-def get_constructions(corpus_files, out_folder, min_freq=5, sep="\t"):
+def pad_ids(flat_ids, lengths):
+    '''Arrange a flat array of element IDs into one padded row per pattern
+    :param flat_ids: NumPy int array with the element IDs of all patterns, one pattern after the other
+    :param lengths: NumPy int array with the number of elements in each pattern
+    :return: a 2D NumPy int array with one row per pattern, padded with -1
+    '''
+    max_len = int(lengths.max()) if len(lengths) else 0
+    # scatter the flat list into the rows: each element goes to its pattern's row, at its position within the pattern
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(flat_ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    pattern_ids = np.full((len(lengths), max_len), -1, dtype=np.int32)
+    pattern_ids[rows, cols] = flat_ids
+    return pattern_ids
 
-    '''Main function to extract construction candidates from the parsed PPME2 files
-    :param corpus files: string with the path to folder containing corpus parsed files (.*psd)
-    :param out_folder: string with the path to folder where results are saved
-    :param min_freq: int with minimum number of cx occurrences. Defaults to 5
-    :param sep: string with output file field separator. "\t" (default) or ";"  
-    :return: prints results to two files - aggregated results and individual results with metadata
+
+def encode_patterns(patterns, element_index):
+    '''Represent construction patterns as a padded array of element IDs, see calculate_total_correlation_batch()
+    :param patterns: list of cx patterns, e.g. ["NP-SBJ VB", "ADVP BE NP-SBJ"]
+    :param element_index: dictionary mapping phrase elements to their position in the element counts
+    :return: a 2D NumPy int array with one row per pattern. Unknown elements are len(element_index), padding is -1
     '''
+    # unknown elements are added to a copy of the index as they are met
+    unknown = len(element_index)
+    element_index = collections.defaultdict(lambda: unknown, element_index)
+    # patterns are joined with single spaces, so the number of elements is one more than the number of spaces
+    lengths = np.fromiter(map(str.count, patterns, itertools.repeat(" ")), dtype=np.int64, count=len(patterns)) + 1
+    flat_ids = np.fromiter(map(element_index.__getitem__, " ".join(patterns).split(" ")), dtype=np.int32, count=int(lengths.sum()))
+    return pad_ids(flat_ids, lengths)
 
-    # The safe ouput file field separators are \t and ;
-    # Reason: cx patterns contain white space and dashes, tree-token IDs contain commas.
-    if sep not in ("\t", ";"):
-        sys.exit("Output field separator must be one of tabulator or semi-colon. Other values *will* cause problems.")
-    
-    # make sure that the minimum frequency threshold is an integer:
-    min_freq = int(min_freq)
-    
-    ### Variables ###
-    
-    ### Global constants for normalizing metadata 
-
-    # ME data
-    # dictionary of files and dialects
-    me_dialects = {"cmkentho.m1" : "Kentish", "cmpeterb.m1" : "East Midlands", "cmorm.po.m1" : "East Midlands", "cmvices1.m1" : "East Midlands", "cmtrinit.mx1" : "East Midlands", 
-    "cmlambx1.mx1" : "West Midlands", "cmlamb1.m1" : "West Midlands", "cmsawles.m1" : "West Midlands", "cmhali.m1" : "West Midlands", "cmkathe.m1" : "West Midlands", "cmjulia.m1" : "West Midlands", "cmmarga.m1" : "West Midlands", "cmancriw-1.m1" : "West Midlands", "cmancriw-2.m1" : "West Midlands",
-    "cmkentse.m2" : "Kentish", "cmayenbi.m2" : "Kentish", "cmearlps.m2" : "East Midlands", "cmaelr3.m23" : "West Midlands", "cmrolltr.m24" : "Northern", "cmrollep.m24" : "Northern",
-    "cmpolych.m3" : "Southern", "cmntest.m3" : "Southern", "cmpurvey.m3" : "Southern", "cmhorses.m3" : "Southern", "cmroyal.m34" : "Southern",
-    "cmctpars.m3" : "East Midlands", "cmctmeli.m3" : "East Midlands", "cmequato.m3" : "East Midlands", "cmwycser.m3" : "East Midlands", "cmboeth.m3" : "East Midlands", "cmotest.m3" : "East Midlands", "cmcloud.m3" : "East Midlands", "cmmandev.m3" : "East Midlands", "cmastro.m3" : "East Midlands", "cmhilton.m34" : "East Midlands", "cmvices4.m34" : "East Midlands", "cmjulnor.m34" : "East Midlands", "cmedvern.m3" : "West Midlands", "cmbrut3.m3" : "West Midlands", "cmmirk.m34" : "West Midlands", "cmbenrul.m3" : "Northern", "cmedthor.m34" : "Northern", "cmgaytry.m34" : "Northern",
-    "cmgregor.m4" : "Southern", "cmaelr4.m4"  : "East Midlands", "cmedmund.m4" : "East Midlands", "cmkempe.m4" : "East Midlands", "cmcapser.m4" : "East Midlands", "cmcapchr.m4" : "East Midlands", "cmreynes.m4" : "East Midlands", "cmreynar.m4" : "East Midlands", "cmfitzja.m4" : "East Midlands", "cminnoce.m4": "East Midlands", "cmmalory.m4" : "West Midlands", "cmsiege.m4" : "West Midlands", "cmthorn.mx4" : "Northern"}
-
-    # dicationary of MS dates   
-    me_dates = {"cmkentho.m1" : 1125, "cmpeterb.m1" : 1150, "cmorm.po.m1" : 1200, "cmvices1.m1" : 1225, "cmtrinit.mx1" : 1225, 
-    "cmlambx1.mx1" : 1225, "cmlamb1.m1" : 1225, "cmsawles.m1" : 1225, "cmhali.m1" : 1225, "cmkathe.m1" : 1225, "cmjulia.m1" : 1225, "cmmarga.m1" : 1225, "cmancriw-1.m1" : 1230, "cmancriw-2.m1" : 1230,
-    "cmkentse.m2" : 1275, "cmayenbi.m2" : 1340, "cmearlps.m2" : 1350, "cmaelr3.m23" : 1400, "cmrolltr.m24" : 1440, "cmrollep.m24" : 1450,
-    "cmpolych.m3" : 1387, "cmntest.m3" : 1388, "cmpurvey.m3" : 1388, "cmhorses.m3" : 1450, "cmroyal.m34" : 1450,
-    "cmctpars.m3" : 1390, "cmctmeli.m3" : 1390, "cmequato.m3" : 1392, "cmwycser.m3" : 1400, "cmboeth.m3" : 1425, "cmotest.m3" : 1425, "cmcloud.m3" : 1425, "cmmandev.m3" : 1425, "cmastro.m3" : 1450, "cmhilton.m34" : 1450, "cmvices4.m34" : 1450, "cmjulnor.m34" : 1450, "cmedvern.m3" : 1390, "cmbrut3.m3" : 1400, "cmmirk.m34" : 1500, "cmbenrul.m3" : 1425, "cmedthor.m34" : 1440, "cmgaytry.m34" : 1440,
-    "cmgregor.m4" : 1475, "cmaelr4.m4"  : 1450, "cmedmund.m4" : 1450, "cmkempe.m4" : 1450, "cmcapser.m4" : 1452, "cmcapchr.m4" : 1464, "cmreynes.m4" : 1485, "cmreynar.m4" : 1481, "cmfitzja.m4" : 1495, "cminnoce.m4": 1497, "cmmalory.m4" : 1470, "cmsiege.m4" : 1500, "cmthorn.mx4" : 1440}
-
-    # dictionary of genres
-    me_genres = {"cmkentho.m1" : "Homily", "cmpeterb.m1" : "History", "cmorm.po.m1" : "Homily", "cmvices1.m1" : "Religious Treatise", "cmtrinit.mx1" : "Homily", 
-    "cmlambx1.mx1" : "Homily", "cmlamb1.m1" : "Homily", "cmsawles.m1" : "Homily", "cmhali.m1" : "Religious Treatise", "cmkathe.m1" : "Biography, Life of Saint", "cmjulia.m1" : "Biography, Life of Saint", 
-    "cmmarga.m1" : "Biography, Life of Saint", "cmancriw-1.m1" : "Religious Treatise", "cmancriw-2.m1" : "Religious Treatise",
-    "cmkentse.m2" : "Homily", "cmayenbi.m2" : "Religious Treatise", "cmearlps.m2" : "Bible", "cmaelr3.m23" : "Rule", "cmrolltr.m24" : "Religious Treatise", 
-    "cmrollep.m24" : "Religious Treatise",
-    "cmpolych.m3" : "History", "cmntest.m3" : "Bible", "cmpurvey.m3" : "Religious Treatise", "cmhorses.m3" : "Handbook", "cmroyal.m34" : "Sermon",
-    "cmctpars.m3" : "Religious Treatise", "cmctmeli.m3" : "Fiction", "cmequato.m3" : "Handbook", "cmwycser.m3" : "Sermon", "cmboeth.m3" : "Philosophy", "cmotest.m3" : "Bible", 
-    "cmcloud.m3" : "Religious Treatise", "cmmandev.m3" : "Travelogue", "cmastro.m3" : "Handbook", "cmhilton.m34" : "Religious Treatise", "cmvices4.m34" : "Religious Treatise", "cmjulnor.m34" : "Religious Treatise", 
-    "cmedvern.m3" : "Religious Treatise", "cmbrut3.m3" : "History", "cmmirk.m34" : "Sermon", "cmbenrul.m3" : "Rule", "cmedthor.m34" : "Religious Treatise", "cmgaytry.m34" : "Sermon",
-    "cmgregor.m4" : "History", "cmaelr4.m4"  : "Rule", "cmedmund.m4" : "Biography, Life of Saint", "cmkempe.m4" : "Religious Treatise", "cmcapser.m4" : "Sermon", "cmcapchr.m4" : "History", 
-    "cmreynes.m4" : "Handbook", "cmreynar.m4" : "Fiction", "cmfitzja.m4" : "Sermon", "cminnoce.m4": "Sermon", "cmmalory.m4" : "Romance", "cmsiege.m4" : "Romance", 
-    "cmthorn.mx4" : "Handbook"}
 
-    
-    # dictionary to count construction frequencies
-    ## key = construction (string), val = count (int)
-    cx_count_dict = {}
-    
-    # dictionary to map constructions to ids:
-    ## key = construction (string), val = corpus tree id
-    cx_id_dict = {}
-    cx_id_dict_broad = {}
-    
-    # dictionary to map narrow constructions to broader ones
-    cx_narrow_to_broad = {}
-    
-    # count occurrences of individual elements, e.g. "NP-SBJ", "ADVP"
-    elements_global_count = {}
+def pad_patterns(patterns):
+    '''Same as encode_patterns(), for pattern keys that already hold element IDs, see ElementVocabulary.encode()
+    :param patterns: list of bytes with packed element IDs
+    :return: a 2D NumPy int array with one row per pattern, padded with -1
+    '''
+    item_size = array.array(element_id_typecode).itemsize
+    lengths = np.fromiter(map(len, patterns), dtype=np.int64, count=len(patterns)) // item_size
+    flat_ids = np.frombuffer(b"".join(patterns), dtype=np.dtype(element_id_typecode)).astype(np.int32)
+    return pad_ids(flat_ids, lengths)
 
-    inTree = False
-    filenames_list = []
-    sent_count = {}
-    
-    id_to_file_dict = {}
-    
-    parsed_files = glob.glob(os.path.join(corpus_files, "*.psd"))
-    
-    # check that at least 1 corpus file was found:
-    if len(parsed_files) == 0:
-        sys.exit("No .psd parsed corpus files found in location.")
-    
-    # iterate over files in directory
-    for file in parsed_files :
-        myFile = open(file, 'r')
-        file_name = os.path.basename(file)
-        file_name_clean = file_name.replace(".psd", "")
-        filenames_list.append(file_name_clean)
-        
-        # currently not used:
-        # extract EME or ME period from filename, e.g. m1, e2
-        myPeriod_match = re.match(r'.*?\.([em]\d\d?)\.psd', file_name)
-        if myPeriod_match:
-            myPeriod = myPeriod_match.group(1)
-            
-        # iterate over each line in each file
-        for line in myFile :
-            beginTree_match = re.match(r'.*?\(IP-MAT.*?(\(ADVP|PP.*?)?', line)
-            if beginTree_match:
-                print("begin")
-                sent_count[file_name_clean] = sent_count.get(file_name_clean, 0) + 1
-                inTree = True
 
-                wo_list = []
-                wo_list_clean = []
+def calculate_total_correlation_batch(freqs, pattern_ids, element_counts, cx_totals_sum, elem_totals_sum):
+    '''Relative frequency and total correlation for many constructions at once, see calculate_cx_total_correlation()
+    :param freqs: NumPy array with the raw count of each construction
+    :param pattern_ids: 2D NumPy int array of element IDs, see encode_patterns()
+    :param element_counts: NumPy array with the global frequency of each phrase element, in element ID order
+    :param cx_totals_sum: sum of all construction occurrences (token frequency)
+    :param elem_totals_sum: sum of all phrase element occurrences
+    :return: a tuple with NumPy arrays of construction relative freq and construction total correlation (NaN where undefined)
 
-                
-                wo_list.append(line.strip())
-                beginTree_match = None
-                sub_match = None
-                
-            if inTree:
-                # check that we are one tab indentations in
-                if len(line.split("\t")) == 2:
-                    # TODO:
-                    # some trees might have an extra indentation for conjunction phrases (CONJP)
-                    # The complement such as a PP or NP continues on the next line
-                    # check if the line ends with a CONJP
-                    
-                    wo_list.append(line.strip())
-                    
-                else :
-                    continue
-                # check if reached end of tree:        
-                endTree_match = re.match(r'.*?\(ID (CM.*?)\).*?', line)
-                if endTree_match:
-                    print("end")
-                    
-                    # Reached end of the current tree. Now process the it
-                    wo_list_clean, wo_list_clean_broad = clean_elements(wo_list)
-                    wo_list_clean_str = " ".join(wo_list_clean)
-                    wo_list_clean_broad_str = " ".join(wo_list_clean_broad)
-                    
-                    if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:    
-                        # update dictionaries
-                        id = endTree_match.group(1)
-                        
-                        id_to_file_dict[id] = file_name_clean
-                        cx_id_dict[wo_list_clean_str] = id
-                        cx_id_dict_broad[wo_list_clean_broad_str] = id
-                        cx_narrow_to_broad[wo_list_clean_str] = wo_list_clean_broad_str
-                        
-                        for e in wo_list_clean:
-                            elements_global_count[e] = elements_global_count.get(e, 0) + 1
-                        
-                        cx_count_dict[wo_list_clean_str] = cx_count_dict.get(wo_list_clean_str, 0) + 1
-
-                    inTree = False
-                    endTree_match = None
-
-    print("done with files")
-   
-    
-    current_time = time.strftime("%Y-%m-%d_%H_%M")
-    base_name_out_aggregated = "treenet_aggregated_{}.txt".format(current_time)
-    base_name_out_full = "treenet_full_data_{}.txt".format(current_time)
-    
-    out_agg = open(os.path.join(out_folder, base_name_out_aggregated), 'w')
-    out_full = open(os.path.join(out_folder, base_name_out_full), 'w')
-    
-    # write header:
-    out_agg_header_str = sep.join(["cx_broad", "cx_narrow", "freq", "rel_freq", "specific_correlation"])
-    out_agg.write("{}\n".format(out_agg_header_str))
-    
-    out_full_header_str = sep.join(["cx_broad", "cx_narrow", "rel_freq", "specific_correlation", "id",
-                "year", "genre", "dialect"])
-    out_full.write("{}\n".format(out_full_header_str))
-    
-    if str(sys.version)[0] == '3':
-        cx_pruned_count_dict = {k: v for k, v in cx_count_dict.items() if v >= min_freq} 
-        
-        cx_metrics = get_total_correlation(total_counts=elements_global_count, cx_counts=cx_pruned_count_dict, py_version=3)
-        
-        for k,v in cx_pruned_count_dict.items():
-            my_id = cx_id_dict.get(k, '')
-            my_file = id_to_file_dict.get(my_id, '')
-            try:
-                my_metrics = cx_metrics[k]
-            except KeyError:
-                my_metrics = None, None
-            
-            out_agg_values = [ cx_narrow_to_broad.get(k, ''), k, v, my_metrics[0], my_metrics[1] ]
-            out_agg_values_str = sep.join([str(x) for x in out_agg_values])
-            out_agg.write("{}\n".format(out_agg_values_str))
-            
-            out_full_values = [cx_narrow_to_broad.get(k, ''), k, my_metrics[0], my_metrics[1], my_id, me_dates.get(my_file, ''), me_genres.get(my_file, ''), me_dialects.get(my_file, '')]
-           
-            
-            out_full_values_str = sep.join([str(x) for x in out_full_values])       
-            
-            out_full.write("{}\n".format(out_full_values_str))
-            
-            
+    The element probabilities are combined as a sum of logs rather than a product, so long patterns do not underflow to 0.
+    '''
+    cx_prob = np.asarray(freqs, dtype=np.float64) / float(cx_totals_sum)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        element_log_probs = np.log(np.asarray(element_counts, dtype=np.float64) / float(elem_totals_sum))
+        # two extra slots: unknown elements have probability 0, and the padding (index -1) adds nothing to the sum
+        element_log_probs = np.concatenate([element_log_probs, [-np.inf, 0.0]])
+        total_corr = np.log(cx_prob) - element_log_probs[pattern_ids].sum(axis=1)
+    # the log of 0 is undefined, as in calculate_cx_total_correlation()
+    total_corr[~np.isfinite(total_corr)] = np.nan
+    return cx_prob, total_corr
+
+
+def get_total_correlation_vectorized(total_counts, cx_counts, chunk_size=100000):
+    '''Same as get_total_correlation(), but scores the constructions in batches with NumPy
+    :param total_counts: dict with individual elements and their global counts
+    :param cx_counts: dict with construction patterns and their counts
+    :param chunk_size: int with the number of patterns scored per batch, which bounds the size of the arrays. Defaults to 100000
+    :returns: a dict with cx patterns (keys) and a tuple with relative frequency and total correlation scores (val)
+    '''
+    total_construction_count = sum(cx_counts.values())
+    total_element_counts = sum(total_counts.values())
+    element_index = dict((e, i) for i, e in enumerate(total_counts))
+    element_counts = np.array(list(total_counts.values()), dtype=np.float64)
+
+    out_dict = {}
+    patterns = list(cx_counts)
+    for start in range(0, len(patterns), chunk_size):
+        chunk = patterns[start:start + chunk_size]
+        freqs = np.array([cx_counts[k] for k in chunk], dtype=np.float64)
+        cx_rel_freq, cx_total_corr = calculate_total_correlation_batch(freqs, encode_patterns(chunk, element_index), element_counts,
+                                                                       total_construction_count, total_element_counts)
+        # NaN is the only value that is not equal to itself
+        cx_total_corr = [None if x != x else x for x in cx_total_corr.tolist()]
+        out_dict.update(zip(chunk, zip(cx_rel_freq.tolist(), cx_total_corr)))
+    return out_dict
+
+
+
+def get_state_total_correlation(state, rows, facet_counts=None):
+    '''Total correlation for patterns in a CountState, using the integer-encoded patterns directly when NumPy is available
+    :param state: CountState with construction and element counts
+    :param rows: list of ints with the rows of the patterns to score in state.patterns, e.g. those above the frequency threshold
+    :param facet_counts: FacetCounts of the state to score instead of its totals, e.g. for one dialect. Defaults to None
+    :returns: a list with a tuple of relative frequency and total correlation for each row
+    '''
+    table = state.patterns
+    counts = facet_counts.counts if facet_counts else table.counts
+    freqs = [counts[row] for row in rows]
+    if np is None:
+        decode = state.vocab.decode
+        cx_counts = dict((decode(table.narrow[row]), freq) for row, freq in zip(rows, freqs))
+        if facet_counts:
+            total_counts = dict((state.vocab.tags[e], count) for e, count in facet_counts.element_counts.items() if count)
+        else:
+            total_counts = state.elements_global_count()
+        cx_metrics = get_total_correlation(total_counts=total_counts, cx_counts=cx_counts)
+        return [cx_metrics[decode(table.narrow[row])] for row in rows]
+    element_counts = np.zeros(len(state.vocab), dtype=np.float64)
+    if facet_counts:
+        element_counts[list(facet_counts.element_counts)] = list(facet_counts.element_counts.values())
     else:
-        cx_pruned_count_dict = {k: v for k, v in cx_count_dict.iteritems() if v >= min_freq} # Python 2.7 requires .iteritems(()
-        cx_metrics = get_total_correlation(total_counts=elements_global_count, cx_counts=cx_pruned_count_dict, py_version=2)
-        
-        for k,v in cx_pruned_count_dict.iteritems():
-            my_id = cx_id_dict.get(k, '')
-            my_file = id_to_file_dict.get(my_id, '')
+        element_counts[:len(state.element_counts)] = state.element_counts
+    cx_rel_freq, cx_total_corr = calculate_total_correlation_batch(np.array(freqs, dtype=np.float64), pad_patterns([table.narrow[row] for row in rows]),
+                                                                   element_counts, sum(freqs), element_counts.sum())
+    # NaN is the only value that is not equal to itself
+    return list(zip(cx_rel_freq.tolist(), [None if x != x else x for x in cx_total_corr.tolist()]))
+
+
+# Sub-pattern mining functions
+
+def mine_gapped(sequences, weights, min_freq, max_length=None):
+    '''Find the frequent sub-sequences of a weighted set of sequences, with gaps allowed, using PrefixSpan (Pei et al. 2001)
+    :param sequences: list of tuples of ints, e.g. the tag IDs of each cx pattern type
+    :param weights: list of ints with the number of occurrences of each sequence
+    :param min_freq: int with the minimum summed weight of the sequences that contain a sub-sequence
+    :param max_length: int with the maximum length of the sub-sequences. Defaults to None (no limit)
+    :return: a list of (sub-sequence, frequency) tuples, for sub-sequences of two or more items
+
+    A prefix is only extended with the items that follow it often enough, since a longer pattern can never be more
+    frequent than its prefix. The suffixes after a prefix are kept as an array of sequence and start positions, packed
+    into single ints, rather than copied.
+    '''
+    shift = max(map(len, sequences), default=0).bit_length()
+    mask = (1 << shift) - 1
+    results = []
+    stack = [((), array.array('q', [i << shift for i in range(len(sequences))]))]
+    while stack:
+        prefix, projected = stack.pop()
+        # the number of suffixes that contain each item, by weight
+        freqs = {}
+        get = freqs.get
+        for code in projected:
+            weight = weights[code >> shift]
+            for item in set(sequences[code >> shift][code & mask:]):
+                freqs[item] = get(item, 0) + weight
+        if max_length is not None and len(prefix) + 1 >= max_length:
+            results.extend((prefix + (item,), freq) for item, freq in freqs.items() if freq >= min_freq)
+            continue
+        # move each suffix past the first occurrence of each frequent item
+        extensions = dict((item, array.array('q')) for item, freq in freqs.items() if freq >= min_freq)
+        for code in projected:
+            sequence = sequences[code >> shift]
+            start = code & mask
+            base = code & ~mask
+            seen = set()
+            for pos in range(start, len(sequence)):
+                item = sequence[pos]
+                if item not in seen:
+                    seen.add(item)
+                    if item in extensions:
+                        extensions[item].append(base | (pos + 1))
+        for item, item_projected in extensions.items():
+            pattern = prefix + (item,)
+            if len(pattern) > 1:
+                results.append((pattern, freqs[item]))
+            stack.append((pattern, item_projected))
+    return [(pattern, freq) for pattern, freq in results if len(pattern) > 1]
+
+
+def mine_contiguous(sequences, weights, min_freq, max_length=None):
+    '''Same as mine_gapped(), for sub-sequences without gaps (n-grams)
+    :return: a list of (sub-sequence, frequency) tuples, for sub-sequences of two or more items
+
+    A sub-sequence can occur more than once in a sequence, so every end position is kept, but each sequence is only
+    counted once.
+    '''
+    shift = max(map(len, sequences), default=0).bit_length()
+    mask = (1 << shift) - 1
+    results = []
+    stack = [((), array.array('q', ((i << shift) | pos for i, sequence in enumerate(sequences) for pos in range(len(sequence)))))]
+    while stack:
+        prefix, projected = stack.pop()
+        extensions = {}
+        for code in projected:
+            sequence = sequences[code >> shift]
+            pos = code & mask
+            if pos < len(sequence):
+                item = sequence[pos]
+                if item in extensions:
+                    extensions[item].append(code + 1)
+                else:
+                    extensions[item] = array.array('q', [code + 1])
+        for item, item_projected in extensions.items():
+            # the positions are in sequence order, so a sequence is only counted the first time
+            freq = 0
+            last = -1
+            for code in item_projected:
+                i = code >> shift
+                if i != last:
+                    freq += weights[i]
+                    last = i
+            if freq < min_freq:
+                continue
+            pattern = prefix + (item,)
+            if len(pattern) > 1:
+                results.append((pattern, freq))
+            if max_length is None or len(pattern) < max_length:
+                stack.append((pattern, item_projected))
+    return results
+
+
+def mine_subpatterns(state, min_freq, max_length=None):
+    '''Find and score the frequent contiguous and gapped sub-patterns of the narrow and broad cx patterns of a count state
+    :param state: CountState with construction and element counts
+    :param min_freq: int with the minimum number of trees that contain a sub-pattern
+    :param max_length: int with the maximum number of elements in a sub-pattern. Defaults to None (no limit)
+    :return: a list of (kind, level, sub-pattern, freq, rel_freq, total correlation) tuples, with kind "contiguous" or
+     "gapped" and level "narrow" or "broad"
+
+    The sub-patterns are mined from the pattern types, weighted by their counts, rather than from every tree. Each group
+    of sub-patterns is scored like the whole patterns, against the element counts of its level.
+    '''
+    table = state.patterns
+    decode = state.vocab.decode
+    broad_counts = collections.Counter()
+    for row, count in enumerate(table.counts):
+        broad_counts[table.broad[row]] += count
+    levels = [("narrow", [tuple(pattern_ids(pattern)) for pattern in table.narrow], list(table.counts)),
+              ("broad", [tuple(pattern_ids(table.broad_patterns[row])) for row in broad_counts], list(broad_counts.values()))]
+    score = get_total_correlation_vectorized if np is not None else get_total_correlation
+
+    results = []
+    for level, sequences, weights in levels:
+        element_counts = collections.Counter()
+        for sequence, weight in zip(sequences, weights):
+            for e in sequence:
+                element_counts[e] += weight
+        total_counts = dict((state.vocab.tags[e], count) for e, count in element_counts.items())
+        for kind, mine in (("contiguous", mine_contiguous), ("gapped", mine_gapped)):
+            cx_counts = dict((decode(array.array(element_id_typecode, pattern).tobytes()), freq)
+                             for pattern, freq in mine(sequences, weights, min_freq, max_length))
+            cx_metrics = score(total_counts=total_counts, cx_counts=cx_counts)
+            for k in sorted(cx_counts):
+                results.append((kind, level, k, cx_counts[k], cx_metrics[k][0], cx_metrics[k][1]))
+    return results
+
+
+
+# Significance functions
+
+def file_counts(state, rows, element_ids):
+    '''Counts of the scored patterns and their elements in each corpus file, read back from the instance spill files
+    :param state: CountState from extract_corpus()
+    :param rows: list of ints with the rows of the scored patterns in state.patterns
+    :param element_ids: NumPy int array with the sorted tag IDs of the elements to count
+    :return: a tuple of 2D NumPy arrays, one row per file, with the element counts (the total of all elements in the last
+     column) and the pattern counts
+    '''
+    if None in state.spill_files:
+        raise ValueError("Resampling corpus files needs the instances of every tree.")
+    decode = state.vocab.decode
+    file_rows = dict((file, i) for i, file in enumerate(state.filenames_list))
+    pattern_columns = dict((decode(state.patterns.narrow[row]), k) for k, row in enumerate(rows))
+    element_columns = dict((state.vocab.tags[e], u) for u, e in enumerate(element_ids.tolist()))
+    pattern_counts = np.zeros((len(file_rows), len(rows)), dtype=np.float64)
+    element_counts = np.zeros((len(file_rows), len(element_ids) + 1), dtype=np.float64)
+    # each distinct pattern is only split into its elements once per file
+    for (file, narrow), count in collections.Counter((file, narrow) for narrow, tree_id, file in iter_instances(state)).items():
+        i = file_rows[file]
+        k = pattern_columns.get(narrow)
+        if k is not None:
+            pattern_counts[i, k] += count
+        elements = narrow.split(" ")
+        for e in elements:
+            u = element_columns.get(e)
+            if u is not None:
+                element_counts[i, u] += count
+        element_counts[i, -1] += count * len(elements)
+    return element_counts, pattern_counts
+
+
+class SignificanceModel(object):
+    '''Counts that the bootstrap replicates of the total correlation scores are drawn from, see bootstrap_significance().
+    The corpus is split into units, the trees of each pattern or the corpus files, and each replicate draws as many
+    units as there are with replacement. Only the elements of the scored patterns are kept, with the total of all
+    elements in the last column
+    '''
+    __slots__ = ("observed", "pattern_ids", "n_elements", "element_groups", "pattern_lengths", "other_elements", "n_units",
+                 "unit_probs", "unit_elements", "unit_patterns", "null_probs")
+
+    def __init__(self, state, rows, resample="trees"):
+        '''
+        :param state: CountState with construction and element counts
+        :param rows: list of ints with the rows of the patterns to score in state.patterns
+        :param resample: "trees" to resample the trees of the corpus, or "files" to resample whole corpus files, which
+         keeps the trees of a text together. Defaults to "trees"
+        '''
+        table = state.patterns
+        self.observed = np.array([table.counts[row] for row in rows], dtype=np.float64)
+        state_ids = pad_patterns([table.narrow[row] for row in rows])
+        element_ids = np.unique(state_ids[state_ids >= 0])
+        # the padding stays -1, which picks the zero column added to the element log probabilities
+        self.pattern_ids = np.where(state_ids >= 0, np.searchsorted(element_ids, state_ids), -1)
+        element_counts = np.zeros(len(state.vocab), dtype=np.float64)
+        element_counts[:len(state.element_counts)] = state.element_counts
+        element_counts = np.append(element_counts[element_ids], element_counts.sum())
+        self.n_elements = len(element_counts)
+
+        if resample == "trees":
+            # for each element position, the patterns sorted by their element there and where each element starts,
+            # so that the elements of the patterns are counted without a patterns by elements matrix
+            self.element_groups = []
+            for j in range(self.pattern_ids.shape[1]):
+                valid = np.flatnonzero(self.pattern_ids[:, j] >= 0)
+                order = valid[np.argsort(self.pattern_ids[valid, j], kind="stable")]
+                ids, starts = np.unique(self.pattern_ids[order, j], return_index=True)
+                self.element_groups.append((order, starts, ids))
+            self.pattern_lengths = (self.pattern_ids >= 0).sum(axis=1).astype(np.float64)
+            # the trees of the patterns below the threshold are one more unit, with their elements spread evenly over them
+            self.n_units = sum(state.sent_count.values()) - state.counters["trees_dropped"]
+            n_other = self.n_units - self.observed.sum()
+            self.other_elements = (element_counts - self.pattern_elements(self.observed[np.newaxis])[0]) / max(n_other, 1)
+            self.unit_probs = np.append(self.observed, n_other) / self.n_units
+            self.unit_elements = self.unit_patterns = None
+        elif resample == "files":
+            self.unit_elements, self.unit_patterns = file_counts(state, rows, element_ids)
+            self.n_units = len(self.unit_elements)
+            self.unit_probs = np.full(self.n_units, 1.0 / self.n_units)
+        else:
+            raise ValueError("Unknown resampling unit: {}".format(resample))
+
+        # without any correlation, a pattern is as likely as the product of the probabilities of its elements
+        with np.errstate(divide='ignore'):
+            element_log_probs = np.append(np.log(element_counts[:-1] / element_counts[-1]), 0.0)
+        self.null_probs = np.exp(element_log_probs[self.pattern_ids].sum(axis=1))
+
+    def pattern_elements(self, counts):
+        '''Count the elements of the trees of the scored patterns, with trees as units
+        :param counts: 2D NumPy array with the pattern counts of each replicate
+        :return: a 2D NumPy array with the element counts of each replicate, with the total of all elements in the last column
+        '''
+        element_counts = np.zeros((len(counts), self.n_elements), dtype=np.float64)
+        for order, starts, ids in self.element_groups:
+            # the patterns with the same element at this position are added up together
+            element_counts[:, ids] += np.add.reduceat(counts[:, order], starts, axis=1)
+        element_counts[:, -1] = counts.dot(self.pattern_lengths)
+        return element_counts
+
+    def draw(self, rng, n):
+        '''Draw bootstrap replicates of the pattern and element counts
+        :param rng: NumPy random Generator
+        :param n: int with the number of replicates
+        :return: a tuple of 2D NumPy arrays with the pattern counts and the element counts, one row per replicate
+        '''
+        draws = rng.multinomial(self.n_units, self.unit_probs, size=n).astype(np.float64)
+        if self.unit_patterns is None:
+            # with trees as units, the first units are the patterns themselves and the last one the other trees
+            counts = draws[:, :-1]
+            return counts, self.pattern_elements(counts) + draws[:, -1:] * self.other_elements
+        return draws.dot(self.unit_patterns), draws.dot(self.unit_elements)
+
+    def score(self, counts, element_counts):
+        '''Total correlation of each pattern in each replicate, see calculate_total_correlation_batch()
+        :param counts: 2D NumPy array with the pattern counts of each replicate
+        :param element_counts: 2D NumPy array with the element counts of each replicate
+        :return: a 2D NumPy array with one row per replicate and one column per pattern, not finite where undefined
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total_corr = np.log(counts / counts.sum(axis=1, keepdims=True))
+            element_log_probs = np.log(element_counts[:, :-1] / element_counts[:, -1:])
+            element_log_probs = np.hstack([element_log_probs, np.zeros((len(counts), 1))])
+            # one element position at a time, so that the arrays stay 2D
+            for j in range(self.pattern_ids.shape[1]):
+                total_corr -= element_log_probs[:, self.pattern_ids[:, j]]
+        return total_corr
+
+
+def init_significance_worker(model):
+    '''Keep the SignificanceModel of a run in this process, so that it is sent to each worker process once rather than
+    with every block of replicates, see significance_block()
+    :param model: SignificanceModel, or None to free it
+    '''
+    global significance_model
+    significance_model = model
+
+
+def significance_block(job):
+    '''Draw one block of bootstrap replicates and null counts, for bootstrap_significance() and multiprocessing.Pool.imap()
+    :param job: tuple with a NumPy SeedSequence and the number of replicates, drawn from the model set by init_significance_worker()
+    :return: a tuple with the replicate scores as a 2D float32 NumPy array, and the number of times each pattern was
+     counted at least as often under independence as it was observed
+    '''
+    seed_sequence, n = job
+    model = significance_model
+    rng = np.random.default_rng(seed_sequence)
+    counts, element_counts = model.draw(rng, n)
+    null_counts = rng.binomial(int(model.observed.sum()), model.null_probs, size=(n, len(model.observed)))
+    return model.score(counts, element_counts).astype(np.float32), (null_counts >= model.observed).sum(axis=0)
+
+
+def bootstrap_significance(state, rows, replicates, resample="trees", seed=0, workers=1):
+    '''Bootstrap confidence intervals and p-values for the total correlation of many constructions at once
+    :param state: CountState with construction and element counts
+    :param rows: list of ints with the rows of the patterns to score in state.patterns, as for get_state_total_correlation()
+    :param replicates: int with the number of bootstrap replicates and of draws under independence
+    :param resample: "trees" or "files", see SignificanceModel. Defaults to "trees"
+    :param seed: int that the random draws are derived from. Defaults to 0
+    :param workers: int with number of processes the blocks of replicates are drawn in. Defaults to 1
+    :return: a list with a tuple of the lower and upper bound of the confidence interval (None where undefined) and
+     the p-value for each row
+
+    The replicates are drawn in blocks of replicate_block_size, each from its own seed, so the results only depend on
+    the seed and not on the number of workers. All the replicate scores are kept for the percentiles, which takes
+    4 bytes per replicate and pattern. The p-value is one-sided, for a total correlation above 0: each draw under
+    independence counts a pattern as often as its elements would occur together by chance.
+    '''
+    if not rows:
+        return []
+    model = SignificanceModel(state, rows, resample)
+    sizes = [min(replicate_block_size, replicates - start) for start in range(0, replicates, replicate_block_size)]
+    jobs = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+    pool = None
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(workers, init_significance_worker, (model,))
+    else:
+        init_significance_worker(model)
+    try:
+        blocks = list(pool.imap(significance_block, jobs) if pool else map(significance_block, jobs))
+    except BaseException:
+        # stop the workers at once, rather than wait for them to draw the remaining blocks
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        init_significance_worker(None)
+
+    # percentile intervals from the sorted replicates. NaN sorts last, like an undefined upper bound
+    scores = np.sort(np.vstack([block[0] for block in blocks]), axis=0)
+    tail = (1 - confidence_level) / 2
+    ci_low = scores[int(math.floor(tail * replicates))].astype(np.float64)
+    ci_high = scores[int(math.ceil((1 - tail) * replicates)) - 1].astype(np.float64)
+    p_values = (sum(block[1] for block in blocks) + 1.0) / (replicates + 1)
+    return [(low if math.isfinite(low) else None, high if math.isfinite(high) else None, p)
+            for low, high, p in zip(ci_low.tolist(), ci_high.tolist(), p_values.tolist())]
+
+
+
+# Corpus source functions
+
+def split_corpus_file(file):
+    '''Split the path of a corpus file in an archive, e.g. "corpus.zip::psd/cmkempe.m4.psd", see find_corpus_files()
+    :param file: string with the path to a corpus file
+    :return: a tuple with the path of the file or archive on disk and the name of the file in the archive, or None
+    '''
+    path, sep, member = file.partition(archive_member_sep)
+    return (path, member) if sep else (file, None)
+
+
+def compression_suffix(name):
+    '''The extension of a compressed file, e.g. ".gz" for "cmkempe.m4.psd.gz", or '' when it is not compressed, see compressed_openers'''
+    for suffix in compressed_openers:
+        if name.endswith(suffix):
+            return suffix
+    return ''
+
+
+def is_corpus_name(name):
+    '''Check whether a file name is that of a parsed corpus file, compressed or not, e.g. "cmkempe.m4.psd.gz"'''
+    return name[:len(name) - len(compression_suffix(name))].endswith(".psd")
+
+
+def corpus_file_name(file):
+    '''Name of a corpus file as used in the output, without folders, ".psd" and compression extensions
+    :param file: string with the path to a corpus file, e.g. "corpus.zip::psd/cmkempe.m4.psd.gz"
+    :return: string with the name, e.g. "cmkempe.m4"
+    '''
+    path, member = split_corpus_file(file)
+    # archive members always use forward slashes
+    name = os.path.basename(path) if member is None else member.rsplit("/", 1)[-1]
+    return name[:len(name) - len(compression_suffix(name))].replace(".psd", "")
+
+
+def list_archive(path):
+    '''Names of the corpus files in a zip or tar archive
+    :param path: string with the path to the archive, see archive_suffixes
+    :return: a list of strings with the names of the members
+    '''
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir() and is_corpus_name(info.filename)]
+    with tarfile.open(path) as archive:
+        return [info.name for info in archive.getmembers() if info.isfile() and is_corpus_name(info.name)]
+
+
+def open_archive(path):
+    '''Open a zip or tar archive, or reuse it when it was the last one opened, so that the members of a compressed tar
+    archive are read in one pass instead of each from the start of the archive
+    :param path: string with the path to the archive, see archive_suffixes
+    :return: a ZipFile or TarFile
+    '''
+    file_stat = os.stat(path)
+    # worker processes open their own copy
+    key = (os.getpid(), os.path.abspath(path), file_stat.st_size, file_stat.st_mtime_ns)
+    archive = open_archives.get(key)
+    if archive is None:
+        for old_archive in open_archives.values():
+            old_archive.close()
+        open_archives.clear()
+        archive = open_archives[key] = zipfile.ZipFile(path) if path.endswith(".zip") else tarfile.open(path)
+    return archive
+
+
+def find_corpus_files(corpus_files):
+    '''Find the parsed corpus files of a run, in folders and their sub-folders, in archives and compressed
+    :param corpus_files: string with the path to a folder, an archive or a corpus file, or a list of them
+    :return: a list of strings with the paths of the corpus files, sorted by file name. Files in archives are given as
+     the path of the archive and the name of the member, joined by archive_member_sep
+    '''
+    if isinstance(corpus_files, str):
+        corpus_files = [corpus_files]
+    found = []
+    for path in corpus_files:
+        if os.path.isdir(path):
+            for folder, sub_folders, file_names in os.walk(path):
+                for file_name in file_names:
+                    file = os.path.join(folder, file_name)
+                    if file_name.endswith(archive_suffixes):
+                        found.extend(archive_member_sep.join([file, member]) for member in list_archive(file))
+                    elif is_corpus_name(file_name):
+                        found.append(file)
+        elif not os.path.isfile(path):
+            # a mistyped path finds no files, as an empty folder would
+            continue
+        elif path.endswith(archive_suffixes):
+            found.extend(archive_member_sep.join([path, member]) for member in list_archive(path))
+        elif is_corpus_name(path):
+            found.append(path)
+    # sorted as the paths of the files in a single folder would be, so that the output does not depend on where they are stored
+    return sorted(found, key=lambda file: (corpus_file_name(file) + ".psd", file))
+
+
+@contextlib.contextmanager
+def open_corpus_bytes(file):
+    '''Open a corpus file for reading bytes, from its archive and decompressed where needed
+    :param file: string with the path to a corpus file, see find_corpus_files()
+    :return: a context manager for a binary file object
+    '''
+    path, member = split_corpus_file(file)
+    with contextlib.ExitStack() as stack:
+        if member is None:
+            f = stack.enter_context(open(path, 'rb'))
+        elif path.endswith(".zip"):
+            f = stack.enter_context(open_archive(path).open(member))
+        else:
+            f = stack.enter_context(open_archive(path).extractfile(member))
+        suffix = compression_suffix(path if member is None else member)
+        if suffix:
+            f = stack.enter_context(compressed_openers[suffix](f))
+        yield f
+
+
+def read_ahead(read, n_blocks=None):
+    '''Call a read function in a background thread, so that e.g. a corpus file is decompressed while the trees read
+    so far are parsed. Decompression releases the GIL, so the two overlap
+    :param read: callable that returns the next block of bytes, and b'' at the end
+    :param n_blocks: int with the maximum number of blocks read ahead. Defaults to read_ahead_blocks
+    :return: a generator of the blocks, in order
+    '''
+    blocks = queue.Queue(n_blocks or read_ahead_blocks)
+    stop = threading.Event()
+
+    def put(item):
+        # give up when the generator is closed before the end, rather than wait for a free slot forever
+        while not stop.is_set():
             try:
-                my_metrics = cx_metrics[k]
-            except KeyError:
-                my_metrics = None, None
-            
-            out_agg_values = [ cx_narrow_to_broad.get(k, ''), k, v, my_metrics[0], my_metrics[1] ]
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-            out_agg_values_str = sep.join([str(x) for x in out_agg_values])
-            out_agg.write("{}\n".format(out_agg_values_str))
-            
-            out_full_values = [cx_narrow_to_broad.get(k, ''), k, my_metrics[0], my_metrics[1],
-                        my_id, me_dates.get(my_file, ''), me_genres.get(my_file, ''), me_dialects.get(my_file, '')]
-            out_full_values_str = sep.join([str(x) for x in out_full_values])       
-            
-            out_full.write("{}\n".format(out_full_values_str))
-            
+    def reader():
+        try:
+            while True:
+                block = read()
+                if not put(block) or not block:
+                    return
+        except Exception as e:
+            put(e)
 
-    # close filehandles before exiting
-    out_agg.close()
-    out_full.close()
-    
-    print("Found {} types and {} tokens".format(len(cx_pruned_count_dict.keys()), sum(cx_pruned_count_dict.values())))
-    
-    
-if __name__ == "__main__":
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        stop.set()
+        thread.join()
 
-    user_args = sys.argv[1:]
-    if len(user_args) < 2:
+
+def iter_block_lines(blocks):
+    '''Split blocks of bytes into lines of text, as a file opened in text mode would: in the locale encoding and
+    with universal newlines
+    :param blocks: iterable of bytes
+    :return: an iterator of strings, one per line
+    '''
+    encoding = locale.getpreferredencoding(False)
+
+    def block_texts():
+        rest = b''
+        for block in blocks:
+            # only whole lines are decoded, so that a character or a "\r\n" is never split between two blocks
+            end = block.rfind(b"\n") + 1
+            if not end:
+                rest += block
+                continue
+            yield io.StringIO((rest + block[:end]).decode(encoding), newline=None)
+            rest = block[end:]
+        if rest:
+            yield io.StringIO(rest.decode(encoding), newline=None)
+
+    # the lines of each block are iterated in C, without a generator step per line
+    return itertools.chain.from_iterable(block_texts())
+
+
+@contextlib.contextmanager
+def open_corpus_lines(file):
+    '''Open a corpus file for reading lines of text. The OS is asked to read plain files ahead while they are parsed,
+    where the platform supports it. Compressed files and archive members are read ahead in a background thread
+    :param file: string with the path to a corpus file, see find_corpus_files()
+    :return: a context manager for an iterable of strings, one per line
+    '''
+    path, member = split_corpus_file(file)
+    if member is None and not compression_suffix(path):
+        with open(path, 'r') as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            yield f
+        return
+    with open_corpus_bytes(file) as f:
+        blocks = read_ahead(functools.partial(f.read, read_block_size))
+        try:
+            yield iter_block_lines(blocks)
+        finally:
+            # stop the reader thread before the file is closed
+            blocks.close()
+
+
+# Corpus extraction functions
+
+class RowWriter(object):
+    '''Write text rows to a file in batches, rather than with one write call per row'''
+    __slots__ = ("f", "rows", "batch_size")
+
+    def __init__(self, f, batch_size=None):
+        '''
+        :param f: file object open for writing text
+        :param batch_size: int with the number of rows kept in memory between writes. Defaults to row_batch_size
+        '''
+        self.f = f
+        self.rows = []
+        self.batch_size = batch_size or row_batch_size
+
+    def write(self, row):
+        '''Add a row, e.g. "NP-SBJ VBD\\tCMKEMPE,1.1\\n", writing the batch when it is full'''
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Write the rows kept in memory'''
+        self.f.writelines(self.rows)
+        self.rows = []
+
+
+def pattern_ids(pattern):
+    '''Unpack the tag IDs of a pattern key, see ElementVocabulary.encode()
+    :param pattern: bytes with packed tag IDs
+    :return: an array of ints
+    '''
+    ids = array.array(element_id_typecode)
+    ids.frombytes(pattern)
+    return ids
+
+
+class ElementVocabulary(object):
+    '''Map phrase element tags, e.g. "NP-SBJ", to small ints, so that each tag string is stored only once and
+    constructions can be stored as tuples of ints
+    '''
+    __slots__ = ("tags", "index")
+
+    def __init__(self):
+        self.tags = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.tags)
+
+    def add(self, tag):
+        '''Look up the ID of a tag, adding the tag if it is new
+        :param tag: string with a phrase element tag
+        :return: int with the tag ID
+        '''
+        try:
+            return self.index[tag]
+        except KeyError:
+            self.index[tag] = len(self.tags)
+            self.tags.append(tag)
+            return len(self.tags) - 1
+
+    def encode(self, elements):
+        '''Encode a list of phrase element tags as a compact, hashable pattern key
+        :param elements: list of strings with tags, e.g. ["ADVP-TMP", "BE", "NP-SBJ"]
+        :return: bytes with the tag IDs as a packed array, see pattern_ids()
+        '''
+        return array.array(element_id_typecode, map(self.add, elements)).tobytes()
+
+    def decode(self, pattern):
+        '''Turn a pattern key back into a cx pattern string, e.g. "ADVP-TMP BE NP-SBJ"
+        :param pattern: bytes with packed tag IDs, see encode()
+        '''
+        tags = self.tags
+        return " ".join([tags[i] for i in pattern_ids(pattern)])
+
+
+class PatternTable(object):
+    '''Table of narrow cx patterns in parallel arrays. Row r holds the narrow pattern key (narrow[r]),
+    its count (counts[r]) and its broad pattern (broad_patterns[broad[r]]). The occurrences of the patterns are
+    written to instance spill files, see extract_file()
+    '''
+    __slots__ = ("index", "narrow", "counts", "broad", "broad_index", "broad_patterns")
+
+    def __init__(self):
+        self.index = {}
+        self.narrow = []
+        self.counts = array.array('q')
+        self.broad = array.array('l')
+        # broad patterns are shared between all the narrow patterns that map to them
+        self.broad_index = {}
+        self.broad_patterns = []
+
+    def __len__(self):
+        return len(self.narrow)
+
+    def add(self, narrow, broad, count=1):
+        '''Count occurrences of a pattern
+        :param narrow: bytes with the narrow pattern key, see ElementVocabulary.encode()
+        :param broad: bytes with the broad pattern key
+        :param count: int with the number of occurrences. Defaults to 1
+        :return: int with the row of the pattern
+        '''
+        row = self.index.get(narrow)
+        if row is None:
+            broad_row = self.broad_index.get(broad)
+            if broad_row is None:
+                broad_row = self.broad_index[broad] = len(self.broad_patterns)
+                self.broad_patterns.append(broad)
+            row = self.index[narrow] = len(self.narrow)
+            self.narrow.append(narrow)
+            self.counts.append(count)
+            self.broad.append(broad_row)
+        else:
+            self.counts[row] += count
+        return row
+
+
+def file_facets(file_name):
+    '''Metadata of a corpus file that the counts can be split by
+    :param file_name: string with the name of a corpus file without ".psd", e.g. "cmkempe.m4"
+    :return: a dict with the period code, genre, dialect and year of the file, by facet name. Unknown values are ''
+    '''
+    period_match = period_re.match(file_name)
+    return {"period": period_match.group(1) if period_match else '', "genre": me_genres.get(file_name, ''),
+            "dialect": me_dialects.get(file_name, ''), "year": me_dates.get(file_name, '')}
+
+
+class FacetCounts(object):
+    '''Construction and element counts of the corpus files that share a facet value, e.g. the files of one dialect.
+    The counts are kept in dicts by the rows and tag IDs of the CountState they belong to, since most patterns only
+    occur under a few of the values of a facet
+    '''
+    __slots__ = ("counts", "element_counts", "sent_count")
+
+    def __init__(self):
+        self.counts = {}
+        self.element_counts = {}
+        self.sent_count = 0
+
+    def add(self, counts, element_counts, sent_count):
+        '''Add counts
+        :param counts: iterable of (row, count) tuples
+        :param element_counts: iterable of (tag ID, count) tuples
+        :param sent_count: int with the number of trees
+        '''
+        own_counts = self.counts
+        for row, count in counts:
+            own_counts[row] = own_counts.get(row, 0) + count
+        own_element_counts = self.element_counts
+        for e, count in element_counts:
+            own_element_counts[e] = own_element_counts.get(e, 0) + count
+        self.sent_count += sent_count
+
+
+class CountState(object):
+    '''Construction and element counts for one or more corpus files, filled in by extract_file() and combined with merge()'''
+    __slots__ = ("vocab", "patterns", "element_counts", "sent_count", "filenames_list", "spill_files", "counters", "facets")
+
+    def __init__(self, facets=None):
+        '''
+        :param facets: list of facet names, e.g. ["dialect", "period"], to keep counts by facet value for, see file_facets().
+         Defaults to None (no facet counts)
+        '''
+        self.vocab = ElementVocabulary()
+        self.patterns = PatternTable()
+        # count occurrences of individual elements, e.g. "NP-SBJ", "ADVP", indexed by tag ID
+        self.element_counts = []
+        self.sent_count = {}
+        self.filenames_list = []
+        # instance spill file of each corpus file in filenames_list, or None where instances were not recorded
+        self.spill_files = []
+        # trees left out by the filter in extract_file(), and elements left out by clean_elements()
+        self.counters = {"trees_dropped": 0, "constituents_skipped": 0}
+        # FacetCounts by facet name and value. Facet counts are filled in by merge(), from partial states
+        self.facets = dict((facet, {}) for facet in facets) if facets else None
+
+    def add_elements(self, elements):
+        '''Count the elements of one tree, without its construction
+        :param elements: list of strings with the cleaned narrow elements, see clean_elements()
+        :return: array with the tag IDs of the elements
+        '''
+        vocab = self.vocab
+        narrow = array.array(element_id_typecode, map(vocab.add, elements))
+        element_counts = self.element_counts
+        if len(element_counts) < len(vocab):
+            element_counts.extend([0] * (len(vocab) - len(element_counts)))
+        for e in narrow:
+            element_counts[e] += 1
+        return narrow
+
+    def add_tree(self, elements, elements_broad):
+        '''Count the construction and the elements of one tree
+        :param elements: list of strings with the cleaned narrow elements, see clean_elements()
+        :param elements_broad: list of strings with the cleaned broad elements
+        '''
+        narrow = self.add_elements(elements)
+        self.patterns.add(narrow.tobytes(), self.vocab.encode(elements_broad))
+
+    def merge(self, partial):
+        '''Merge the counts of another state into this one, in place
+        :param partial: count state to add, e.g. the result of extract_file() for one corpus file
+        :return: the updated state
+
+        Partials must be merged in corpus file order for the output to match a serial run. When this state keeps facet
+        counts, the partial must either keep the same facet counts or hold a single corpus file.
+        '''
+        # tag IDs are local to each state
+        remap = [self.vocab.add(tag) for tag in partial.vocab.tags]
+        element_counts = self.element_counts
+        element_counts.extend([0] * (len(self.vocab) - len(element_counts)))
+        for e, count in enumerate(partial.element_counts):
+            element_counts[remap[e]] += count
+        table = partial.patterns
+        def remap_pattern(pattern):
+            return array.array(element_id_typecode, [remap[e] for e in pattern_ids(pattern)]).tobytes()
+        broad_patterns = [remap_pattern(broad) for broad in table.broad_patterns]
+        row_map = [self.patterns.add(remap_pattern(narrow), broad_patterns[table.broad[row]], table.counts[row])
+                   for row, narrow in enumerate(table.narrow)]
+        if self.facets is not None:
+            self.merge_facets(partial, row_map, remap)
+        for k, v in partial.sent_count.items():
+            self.sent_count[k] = self.sent_count.get(k, 0) + v
+        self.filenames_list.extend(partial.filenames_list)
+        self.spill_files.extend(partial.spill_files)
+        for k, v in partial.counters.items():
+            self.counters[k] += v
+        return self
+
+    def merge_facets(self, partial, row_map, remap):
+        '''Add the counts of a partial state to the facet counts, see merge()
+        :param partial: count state being merged
+        :param row_map: list with the row in this state of each row of the partial
+        :param remap: list with the tag ID in this state of each tag ID of the partial
+        '''
+        if partial.facets is not None:
+            for facet, values in self.facets.items():
+                for value, facet_counts in partial.facets[facet].items():
+                    values.setdefault(value, FacetCounts()).add(
+                        ((row_map[row], count) for row, count in facet_counts.counts.items()),
+                        ((remap[e], count) for e, count in facet_counts.element_counts.items()), facet_counts.sent_count)
+        elif len(partial.filenames_list) == 1:
+            # all the counts of a single file go to the facet values of that file
+            file_values = file_facets(partial.filenames_list[0])
+            sent_count = sum(partial.sent_count.values())
+            for facet, values in self.facets.items():
+                values.setdefault(file_values[facet], FacetCounts()).add(
+                    zip(row_map, partial.patterns.counts), ((remap[e], count) for e, count in enumerate(partial.element_counts) if count), sent_count)
+        else:
+            raise ValueError("Cannot split the counts of {} corpus files by facet.".format(len(partial.filenames_list)))
+
+    def cx_count_dict(self):
+        '''Construction counts as a dict with cx pattern strings as keys, e.g. for get_total_correlation()'''
+        decode = self.vocab.decode
+        return dict(zip(map(decode, self.patterns.narrow), self.patterns.counts))
+
+    def elements_global_count(self):
+        '''Element counts as a dict with element strings as keys, e.g. for get_total_correlation()'''
+        return dict((tag, count) for tag, count in zip(self.vocab.tags, self.element_counts) if count)
+
+
+class ClauseStates(object):
+    '''Counts for several clause types of the same corpus files, e.g. IP-MAT and IP-SUB, with a CountState for each
+    clause label, filled in by extract_clauses() and combined with merge(). Each clause type has its own patterns,
+    element counts and scores
+    '''
+    __slots__ = ("labels", "states")
+
+    def __init__(self, labels, facets=None):
+        '''
+        :param labels: list of strings with clause labels, e.g. ["IP-MAT", "IP-SUB"], see clause_label_re()
+        :param facets: list of facet names to keep counts by facet value for, see CountState. Defaults to None
+        '''
+        self.labels = list(labels)
+        self.states = [CountState(facets) for label in self.labels]
+
+    def merge(self, partial):
+        '''Merge the counts of other ClauseStates with the same labels into these, in place, see CountState.merge()
+        :param partial: ClauseStates to add, e.g. the result of extract_clauses() for one corpus file
+        :return: the updated states
+        '''
+        if partial.labels != self.labels:
+            raise ValueError("Cannot merge the counts of clause types {} into {}.".format(partial.labels, self.labels))
+        for state, partial_state in zip(self.states, partial.states):
+            state.merge(partial_state)
+        return self
+
+
+def split_constituents(tree, start):
+    '''Find the immediate constituents of a bracketed phrase
+    :param tree: string with a bracketed tree
+    :param start: int with the position just after the label of the phrase
+    :return: a list of strings with the constituents, each from its opening to its closing bracket
+    '''
+    constituents = []
+    depth = 0
+    pos = start
+    # one pass over the brackets, a constituent starts and ends at depth 0
+    for bracket_match in bracket_re.finditer(tree, start):
+        if bracket_match.group() == '(':
+            if depth == 0:
+                pos = bracket_match.start()
+            depth += 1
+        elif depth == 0:
+            # a closing bracket between constituents ends the phrase itself
+            break
+        else:
+            depth -= 1
+            if depth == 0:
+                constituents.append(tree[pos:bracket_match.end()])
+    if depth > 0:
+        # unbalanced tree, keep what is there
+        constituents.append(tree[pos:])
+    return constituents
+
+
+def parse_tree(tree):
+    '''Separate a bracketed corpus tree into the constituents of its matrix clause and its ID
+    :param tree: string with one complete tree, e.g. "( (IP-MAT (NP-SBJ (PRO he)) (VBD seyde)) (ID CMMALORY,1.3))"
+    :return: a tuple with the tree ID and a list of the matrix clause constituents, or None if the tree is not an IP-MAT tree
+    '''
+    ip_mat_match = ip_mat_re.search(tree)
+    if not ip_mat_match:
+        return None
+    # the matrix clause must be the top phrase or sit directly inside the unlabelled wrapper bracket
+    if tree.count('(', 0, ip_mat_match.start()) > 1:
+        return None
+    id_match = tree_id_re.search(tree)
+    tree_id = id_match.group(1) if id_match else ''
+    return tree_id, split_constituents(tree, ip_mat_match.end())
+
+
+def clause_label_re(labels):
+    '''Compile a regular expression for the opening bracket and label of clauses, e.g. "(IP-SUB-SPE" for "IP-SUB"
+    :param labels: list of strings with clause labels, e.g. ["IP-MAT", "IP-SUB", "CP-REL"]
+    :return: a compiled regular expression with the matching label in group 1. Where labels overlap, e.g. "IP" and
+     "IP-SUB", the longest one is used
+    '''
+    alternatives = "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True))
+    return re.compile(r'\(\s*({})(?=[-=\s()])[^\s()]*'.format(alternatives))
+
+
+def parse_clauses(tree, clause_re):
+    '''Separate a bracketed corpus tree into the constituents of each of its clauses with one of the given labels, at any depth
+    :param tree: string with one complete tree
+    :param clause_re: compiled regular expression for the clause labels, see clause_label_re()
+    :return: a tuple with the tree ID and a list of (clause label, list of constituents) tuples in the order of the
+     tree, or None if the tree has none of the clauses
+    '''
+    # each clause only splits its own part of the tree, so nested clauses do not make the tree be read again
+    clauses = [(clause_match.group(1), split_constituents(tree, clause_match.end())) for clause_match in clause_re.finditer(tree)]
+    if not clauses:
+        return None
+    id_match = tree_id_re.search(tree)
+    tree_id = id_match.group(1) if id_match else ''
+    return tree_id, clauses
+
+
+def iter_trees(source, clause_re=None):
+    '''Read the IP-MAT trees of a corpus file one at a time, balancing brackets across lines
+    :param source: string with the path to a corpus file, see find_corpus_files(), or an iterable of lines
+    :param clause_re: compiled regular expression for clause labels to find at any depth of each tree instead, see
+     clause_label_re(). Defaults to None (the IP-MAT at the top of each tree)
+    :return: a generator of (tree ID, list of matrix clause constituents) tuples, see parse_tree(), or with clause_re
+     of (tree ID, list of (clause label, list of constituents) tuples) tuples, see parse_clauses()
+    '''
+    if isinstance(source, str):
+        with open_corpus_lines(source) as lines:
+            for tree in iter_trees(lines, clause_re):
+                yield tree
+        return
+
+    tree_lines = []
+    depth = 0
+    for line in source:
+        if tree_lines:
+            tree_lines.append(line)
+        elif '(' in line:
+            tree_lines = [line]
+        else:
+            # blank lines and any text between trees
+            continue
+        depth += line.count('(') - line.count(')')
+        if depth <= 0:
+            parsed = parse_tree("".join(tree_lines)) if clause_re is None else parse_clauses("".join(tree_lines), clause_re)
+            if parsed:
+                yield parsed
+            tree_lines = []
+            depth = 0
+
+
+def extract_file(file, state=None, spill_path=None, keep=None):
+    '''Extract construction counts from a single parsed corpus file
+    :param file: string with the path to a corpus file, see find_corpus_files()
+    :param state: CountState to add the counts to. Defaults to None, which creates a new state for this file only
+    :param spill_path: string with the path of a file where every occurrence is written as a line with the narrow
+     pattern and the tree ID, separated by a tab. Defaults to None (occurrences are not recorded)
+    :param keep: callable that takes a narrow cx pattern string and returns False for patterns not to count, see
+     CountMinSketch. The elements of these patterns are still counted. Defaults to None (all patterns are counted)
+    :return: the CountState
+    '''
+    if state is None:
+        state = CountState()
+    sent_count = state.sent_count
+
+    file_name_clean = corpus_file_name(file)
+    state.filenames_list.append(file_name_clean)
+    state.spill_files.append(spill_path)
+
+    spill = open(spill_path, 'w') if spill_path else None
+    spill_writer = RowWriter(spill) if spill else None
+
+    counters = state.counters
+    trees_dropped = 0
+
+    # iterate over each tree in the file
+    for id, wo_list in iter_trees(file):
+        sent_count[file_name_clean] = sent_count.get(file_name_clean, 0) + 1
+
+        wo_list_clean, wo_list_clean_broad = clean_elements(wo_list, counters)
+
+        if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:
+            if keep is None or keep(" ".join(wo_list_clean)):
+                state.add_tree(wo_list_clean, wo_list_clean_broad)
+                if spill_writer:
+                    spill_writer.write("{}\t{}\n".format(" ".join(wo_list_clean), id))
+            else:
+                state.add_elements(wo_list_clean)
+        else:
+            trees_dropped += 1
+    counters["trees_dropped"] += trees_dropped
+
+    if spill:
+        spill_writer.flush()
+        spill.close()
+    return state
+
+
+def clause_spill_path(spill_path, label):
+    '''Path of the instance spill file of one clause type, next to the spill file of the corpus file, e.g.
+    "000001_cmkempe.m4.IP-SUB.spill", see extract_clauses()'''
+    return "{}.{}.spill".format(spill_path[:-len(".spill")], label)
+
+
+def extract_clauses(file, states=None, spill_path=None, clauses=None):
+    '''Extract construction counts for several clause types from a single parsed corpus file, in one pass over its
+    trees, see extract_file(). Every clause is counted as a tree of its own type, so a tree may add to several types
+    :param file: string with the path to a corpus file, see find_corpus_files()
+    :param states: ClauseStates to add the counts to. Defaults to None, which creates new states for this file only
+    :param spill_path: string with the path of the instance spill file of the corpus file. Each clause type is spilled
+     to its own file next to it, see clause_spill_path(). Defaults to None (occurrences are not recorded)
+    :param clauses: list of clause labels, used when states is None
+    :return: the ClauseStates
+    '''
+    if states is None:
+        states = ClauseStates(clauses)
+    file_name_clean = corpus_file_name(file)
+    clause_states = {}
+    spill_writers = []
+    try:
+        for label, state in zip(states.labels, states.states):
+            state.filenames_list.append(file_name_clean)
+            state_spill_path = clause_spill_path(spill_path, label) if spill_path else None
+            state.spill_files.append(state_spill_path)
+            spill_writer = RowWriter(open(state_spill_path, 'w')) if state_spill_path else None
+            if spill_writer:
+                spill_writers.append(spill_writer)
+            clause_states[label] = state, spill_writer
+
+        for id, clauses_found in iter_trees(file, clause_label_re(states.labels)):
+            for label, wo_list in clauses_found:
+                state, spill_writer = clause_states[label]
+                state.sent_count[file_name_clean] = state.sent_count.get(file_name_clean, 0) + 1
+                wo_list_clean, wo_list_clean_broad = clean_elements(wo_list, state.counters)
+                # the same filter as in extract_file()
+                if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:
+                    state.add_tree(wo_list_clean, wo_list_clean_broad)
+                    if spill_writer:
+                        spill_writer.write("{}\t{}\n".format(" ".join(wo_list_clean), id))
+                else:
+                    state.counters["trees_dropped"] += 1
+    finally:
+        for spill_writer in spill_writers:
+            spill_writer.flush()
+            spill_writer.f.close()
+    return states
+
+
+def extract_file_job(job):
+    '''Call extract_file(), or extract_clauses() when there are clause labels, with a (file, spill_path, clauses)
+    tuple, for multiprocessing.Pool.imap()'''
+    file, spill_path, clauses = job
+    if clauses:
+        return extract_clauses(file, spill_path=spill_path, clauses=clauses)
+    return extract_file(file, spill_path=spill_path)
+
+
+# Approximate counting functions
+
+class CountMinSketch(object):
+    '''Count-min sketch of cx pattern counts in a fixed amount of memory, with conservative update. The estimate of a
+    pattern is never below its true count, and is above it by at most e/width of all the counts with probability
+    1 - exp(-depth), see Cormode and Muthukrishnan (2005)
+    '''
+    __slots__ = ("width", "depth", "table")
+
+    def __init__(self, size_mb, depth=None):
+        '''
+        :param size_mb: float with the size of the sketch in megabytes
+        :param depth: int with the number of hash functions. Defaults to sketch_depth
+        '''
+        self.depth = depth or sketch_depth
+        self.width = max(1, int(size_mb * 2 ** 20) // (4 * self.depth))
+        self.table = array.array('I', bytes(4 * self.width * self.depth))
+
+    def cells(self, pattern):
+        '''Positions of a pattern in the table, one per row, from a hash that is the same in every process'''
+        digest = hashlib.blake2b(pattern.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, pattern):
+        '''Count one occurrence of a pattern, raising only the cells that are at the current estimate'''
+        table = self.table
+        cells = self.cells(pattern)
+        estimate = min([table[cell] for cell in cells]) + 1
+        for cell in cells:
+            if table[cell] < estimate:
+                table[cell] = estimate
+
+    def estimate(self, pattern):
+        '''Estimated count of a pattern, never below the true count'''
+        table = self.table
+        return min([table[cell] for cell in self.cells(pattern)])
+
+    def frequent(self, pattern, min_freq):
+        '''Check whether a pattern may occur at least min_freq times, e.g. as the keep callable of extract_file()'''
+        return self.estimate(pattern) >= min_freq
+
+
+def sketch_corpus(parsed_files, sketch):
+    '''Count the cx patterns of a corpus in a count-min sketch, as the first pass of the approximate mode
+    :param parsed_files: list of paths to .psd files
+    :param sketch: CountMinSketch to add the patterns to
+    '''
+    for file in parsed_files:
+        for id, wo_list in iter_trees(file):
+            wo_list_clean = clean_elements(wo_list)[0]
+            # the same filter as in extract_file()
+            if len(wo_list_clean) > 1 and len(set(wo_list_clean)) > 1:
+                sketch.add(" ".join(wo_list_clean))
+
+
+# Count cache functions
+
+def extractor_fingerprint(clauses=None):
+    '''Fingerprint the code that turns corpus files into counts, so that cached counts are dropped when the cleaning rules change
+    :param clauses: list of clause labels that the counts are split by, see extract_clauses(). Defaults to None
+    :return: string with a hex digest of the cache version, the regular expressions and the extraction functions
+    '''
+    fingerprint = hashlib.sha1(str(cache_version).encode("utf-8"))
+    fingerprint.update(repr((sorted(verb_elements.items()), ip_mat_excluded, plain_elements, clause_head_elements, wh_elements,
+                              clauses and list(clauses))).encode("utf-8"))
+    # the patterns that find the clauses, tree IDs and element labels in the trees
+    for pattern_re in (ip_mat_re, tree_id_re, element_head_re, nested_bracket_re, tree_token_re, bracket_re):
+        fingerprint.update(pattern_re.pattern.encode("utf-8"))
+    for func in (split_corpus_file, compression_suffix, corpus_file_name, iter_block_lines,
+                 remove_phrase_details, replace_coindex, top_tokens, compile_element_rule, constituent_signature, clean_signature.__wrapped__,
+                 clean_constituent, clean_elements,
+                 split_constituents, parse_tree, clause_label_re, parse_clauses, iter_trees, extract_file, extract_clauses):
+        try:
+            fingerprint.update(inspect.getsource(func).encode("utf-8"))
+        except (OSError, TypeError):
+            # source not available, e.g. in a frozen application
+            fingerprint.update(func.__code__.co_code)
+    return fingerprint.hexdigest()
+
+
+def file_digest(file):
+    '''Hash the contents of a corpus file
+    :param file: string with the path to a corpus file, see find_corpus_files()
+    :return: string with the hex digest of the file contents, after decompression
+    '''
+    digest = hashlib.sha1()
+    with open_corpus_bytes(file) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_entry_path(cache_dir, file):
+    '''Path of the cache entry for a corpus file
+    :param cache_dir: string with the path to the cache folder
+    :param file: string with the path to a corpus file
+    '''
+    name = hashlib.sha1(os.path.abspath(file).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, name + ".pickle")
+
+
+def save_cached_state(cache_dir, file, state, fingerprint):
+    '''Store the counts extracted from a corpus file in the cache
+    :param cache_dir: string with the path to the cache folder
+    :param file: string with the path to the corpus file
+    :param state: count state for the file, see extract_file()
+    :param fingerprint: string with the extractor fingerprint, see extractor_fingerprint()
+    '''
+    # files in an archive have the size and modification time of the archive
+    file_stat = os.stat(split_corpus_file(file)[0])
+    key = {"path": os.path.abspath(file), "size": file_stat.st_size, "mtime": file_stat.st_mtime_ns,
+           "sha1": file_digest(file), "fingerprint": fingerprint}
+    entry_path = cache_entry_path(cache_dir, file)
+    # write to a temporary file first, so that an interrupted run never leaves a broken entry behind
+    with open(entry_path + ".tmp", 'wb') as f:
+        # the key is pickled on its own so that it can be checked without loading the counts
+        pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(entry_path + ".tmp", entry_path)
+
+
+def is_cached(cache_dir, file, fingerprint, clauses=None):
+    '''Check whether the cache holds up to date counts for a corpus file, and the instance spill files that go with them
+    :param cache_dir: string with the path to the cache folder
+    :param file: string with the path to the corpus file
+    :param fingerprint: string with the extractor fingerprint, see extractor_fingerprint()
+    :param clauses: list of clause labels that the counts are split by, see extract_clauses(). Defaults to None
+    :return: True if the cached counts can be used
+    '''
+    if not all(os.path.exists(spill_path) for spill_path in cached_spill_files(cache_dir, file, clauses)):
+        return False
+    entry_path = cache_entry_path(cache_dir, file)
+    try:
+        with open(entry_path, 'rb') as f:
+            key = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return False
+    # files in an archive have the size and modification time of the archive
+    file_stat = os.stat(split_corpus_file(file)[0])
+    if key["fingerprint"] != fingerprint or key["size"] != file_stat.st_size:
+        return False
+    if key["mtime"] != file_stat.st_mtime_ns:
+        # touched but maybe not edited: compare contents, and store the new mtime if they are the same
+        if key["sha1"] != file_digest(file):
+            return False
+        save_cached_state(cache_dir, file, load_cached_state(cache_dir, file), fingerprint)
+    return True
+
+
+def load_cached_state(cache_dir, file):
+    '''Load the cached counts for a corpus file, see is_cached()
+    :param cache_dir: string with the path to the cache folder
+    :param file: string with the path to the corpus file
+    :return: count state for the file
+    '''
+    with open(cache_entry_path(cache_dir, file), 'rb') as f:
+        pickle.load(f) # skip the key
+        state = pickle.load(f)
+    # the spill files are next to the entry, whichever way the path to the cache folder is given in this run
+    if isinstance(state, ClauseStates):
+        for clause_state, spill_path in zip(state.states, cached_spill_files(cache_dir, file, state.labels)):
+            clause_state.spill_files = [spill_path]
+    else:
+        state.spill_files = cached_spill_files(cache_dir, file)
+    return state
+
+
+def prune_cache(cache_dir):
+    '''Remove the cache entries of corpus files that no longer exist
+    :param cache_dir: string with the path to the cache folder
+    '''
+    for entry_path in glob.glob(os.path.join(cache_dir, "*.pickle")):
+        try:
+            with open(entry_path, 'rb') as f:
+                key = pickle.load(f)
+            keep = os.path.exists(split_corpus_file(key["path"])[0])
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            keep = False
+        if not keep:
+            os.remove(entry_path)
+    # instance spill files belong to the entry with the same name, before the clause label, see clause_spill_path()
+    for spill_path in glob.glob(os.path.join(cache_dir, "*.spill")):
+        if not os.path.exists(os.path.join(cache_dir, os.path.basename(spill_path).split(".")[0] + ".pickle")):
+            os.remove(spill_path)
+
+
+def spill_file_path(i, file, cache_dir=None, spill_dir=None):
+    '''Path of the instance spill file of a corpus file, next to its cached counts or in spill_dir, see extract_corpus()
+    :param i: int with the position of the file in the corpus
+    :param file: string with the path to the corpus file
+    :return: string with the path, or None if neither folder is given
+    '''
+    if cache_dir:
+        return cache_entry_path(cache_dir, file)[:-len(".pickle")] + ".spill"
+    elif spill_dir:
+        return os.path.join(spill_dir, "{:06d}_{}.spill".format(i, corpus_file_name(file)))
+    return None
+
+
+def cached_spill_files(cache_dir, file, clauses=None):
+    '''Paths of the instance spill files kept next to the cached counts of a corpus file, see spill_file_path()
+    :param cache_dir: string with the path to the cache folder
+    :param file: string with the path to the corpus file
+    :param clauses: list of clause labels that the counts are split by, see clause_spill_path(). Defaults to None
+    :return: list of strings with the paths, one for each clause label, or one for the file when there are no clause labels
+    '''
+    spill_path = spill_file_path(0, file, cache_dir)
+    if clauses:
+        return [clause_spill_path(spill_path, label) for label in clauses]
+    return [spill_path]
+
+
+def iter_file_states(parsed_files, workers=1, cache_dir=None, spill_dir=None, clauses=None):
+    '''Extract the counts of each corpus file on its own, from the cache where possible, see extract_corpus() for the parameters
+    :return: a generator of (file, count state) tuples, in the order of parsed_files
+    '''
+    cached_files = set()
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        prune_cache(cache_dir)
+        fingerprint = extractor_fingerprint(clauses)
+        cached_files = set(file for file in parsed_files if is_cached(cache_dir, file, fingerprint, clauses))
+    jobs = [(file, spill_file_path(i, file, cache_dir, spill_dir), clauses) for i, file in enumerate(parsed_files) if file not in cached_files]
+
+    pool = None
+    if workers > 1 and len(jobs) > 1:
+        # imap returns the partials in input order, so the merge is the same whatever the number of workers
+        pool = multiprocessing.Pool(workers)
+        new_partials = pool.imap(extract_file_job, jobs)
+    else:
+        new_partials = (extract_file_job(job) for job in jobs)
+    try:
+        for file in parsed_files:
+            if file in cached_files:
+                partial = load_cached_state(cache_dir, file)
+            else:
+                partial = next(new_partials)
+                if cache_dir:
+                    save_cached_state(cache_dir, file, partial, fingerprint)
+            yield file, partial
+    except BaseException:
+        # on an error, or when the caller stops early, stop the workers at once rather than wait for them to read the
+        # rest of the corpus
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+def extract_corpus(parsed_files, workers=1, cache_dir=None, spill_dir=None, metrics=None, facets=None, keep=None, clauses=None):
+    '''Extract and merge construction counts from a list of corpus files
+    :param parsed_files: list of paths to .psd files
+    :param workers: int with number of worker processes. Defaults to 1 (no parallelism)
+    :param cache_dir: string with the path to a folder where the counts of each file are cached between runs. Defaults to None (no cache)
+    :param spill_dir: string with the path to a folder for the instance spill files, see extract_file(). Defaults to None,
+     which records no instances unless there is a cache, where the spill files are kept next to the cached counts
+    :param metrics: RunMetrics that is updated after each file. Defaults to None
+    :param facets: list of facet names to keep counts by facet value for, see CountState. Defaults to None
+    :param keep: callable that selects the patterns to count, see extract_file(). Only used in a single process without
+     a cache. Defaults to None (all patterns are counted)
+    :param clauses: list of clause labels to count separately, at any depth of the trees, see extract_clauses().
+     Defaults to None (the IP-MAT at the top of each tree)
+    :return: the merged count state for all files, or ClauseStates when there are clause labels
+    '''
+    if clauses:
+        merged = ClauseStates(clauses, facets)
+        extract = functools.partial(extract_clauses, clauses=clauses)
+    else:
+        merged = CountState(facets)
+        extract = functools.partial(extract_file, keep=keep)
+    if not cache_dir and workers <= 1:
+        for i, file in enumerate(parsed_files):
+            file_spill_path = spill_file_path(i, file, spill_dir=spill_dir)
+            if facets:
+                # facet counts are filled in from the state of each file
+                merged.merge(extract(file, None, file_spill_path))
+            else:
+                # count straight into the merged state, without a partial state per file
+                extract(file, merged, file_spill_path)
+            if metrics:
+                metrics.file_done(merged)
+        return merged
+
+    for file, partial in iter_file_states(parsed_files, workers, cache_dir, spill_dir, clauses):
+        merged.merge(partial)
+        if metrics:
+            metrics.file_done(merged)
+    return merged
+
+
+def iter_instances(state):
+    '''Read back the occurrences recorded in the instance spill files of a count state, in corpus order
+    :param state: CountState from extract_corpus()
+    :return: a generator of (narrow cx pattern, tree ID, file name) tuples
+    '''
+    for file_name, spill_path in zip(state.filenames_list, state.spill_files):
+        if not spill_path:
+            continue
+        with open(spill_path, 'r') as spill:
+            for line in spill:
+                narrow, tree_id = line.rstrip("\n").split("\t")
+                yield narrow, tree_id, file_name
+
+
+def write_full_data(state, cx_metrics, out_path, sep="\t", clause_type=None, append=False):
+    '''Write every occurrence of the patterns that passed the frequency threshold, with its metadata, in one
+    sequential pass over the instance spill files
+    :param state: CountState from extract_corpus()
+    :param cx_metrics: dict mapping the narrow cx patterns to keep to a tuple with their broad pattern, relative frequency and total correlation
+    :param out_path: string with the path of the output file. Paths ending in ".gz" are gzip compressed
+    :param sep: string with output file field separator
+    :param clause_type: string with the clause label of the state, written in a first clause_type column, see ClauseStates. Defaults to None (no column)
+    :param append: bool, add the rows to an existing output file, without a header, e.g. for the next clause type. Defaults to False
+    :return: int with the number of occurrences written
+    '''
+    mode = 'a' if append else 'w'
+    out_full = gzip.open(out_path, mode + 't') if out_path.endswith(".gz") else open(out_path, mode)
+    out_full_writer = RowWriter(out_full)
+    prefix = [clause_type] if clause_type else []
+    
+    # write header:
+    if not append:
+        out_full_header_str = sep.join(["clause_type"] * len(prefix) + ["cx_broad", "cx_narrow", "rel_freq", "specific_correlation", "id",
+                    "file", "year", "genre", "dialect"])
+        out_full.write("{}\n".format(out_full_header_str))
+
+    n_rows = 0
+    for k, my_id, my_file in iter_instances(state):
+        my_metrics = cx_metrics.get(k)
+        if my_metrics is None:
+            continue
+        out_full_values = prefix + [my_metrics[0], k, my_metrics[1], my_metrics[2], my_id, my_file, me_dates.get(my_file, ''), me_genres.get(my_file, ''), me_dialects.get(my_file, '')]
+        out_full_writer.write("{}\n".format(sep.join([str(x) for x in out_full_values])))
+        n_rows += 1
+
+    # close filehandles before exiting
+    out_full_writer.flush()
+    out_full.close()
+    return n_rows
+
+
+def write_facet_data(state, facet_metrics, out_path, sep="\t", clause_type=None, append=False):
+    '''Write the aggregated results for each facet value
+    :param state: CountState from extract_corpus()
+    :param facet_metrics: list of (facet, value, FacetCounts, rows, metrics) tuples, with the rows of the patterns that
+     passed the frequency threshold for the value and a tuple of relative frequency and total correlation for each row
+    :param out_path: string with the path of the output file
+    :param sep: string with output file field separator
+    :param clause_type: string with the clause label of the state, see write_full_data(). Defaults to None (no column)
+    :param append: bool, add the rows to an existing output file, without a header. Defaults to False
+    '''
+    table = state.patterns
+    decode = state.vocab.decode
+    prefix = [clause_type] if clause_type else []
+    with open(out_path, 'a' if append else 'w') as out_facets:
+        out_facets_writer = RowWriter(out_facets)
+        if not append:
+            out_facets.write("{}\n".format(sep.join(["clause_type"] * len(prefix) + ["facet", "value", "cx_broad", "cx_narrow", "freq", "rel_freq",
+                                                       "specific_correlation"])))
+        for facet, value, facet_counts, rows, cx_metrics in facet_metrics:
+            for row, my_metrics in zip(rows, cx_metrics):
+                out_facets_values = prefix + [facet, value, decode(table.broad_patterns[table.broad[row]]), decode(table.narrow[row]),
+                                     facet_counts.counts[row], my_metrics[0], my_metrics[1]]
+                out_facets_writer.write("{}\n".format(sep.join([str(x) for x in out_facets_values])))
+        out_facets_writer.flush()
+
+
+# Inverted index functions
+
+def write_string_table(path, strings):
+    '''Write strings as one UTF-8 blob (path + ".str") and an array of their start offsets (path + ".off"), see StringTable
+    :param path: string with the path of the table, without extension
+    :param strings: iterable of strings
+    '''
+    offsets = array.array('Q', [0])
+    with open(path + ".str", 'wb') as f:
+        for string in strings:
+            encoded = string.encode("utf-8")
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    with open(path + ".off", 'wb') as f:
+        write_array(f, offsets)
+
+
+def write_postings(path, postings):
+    '''Write lists of ints as one uint32 array (path + ".ids") and an array of their start offsets (path + ".off"), see Postings
+    :param path: string with the path of the postings, without extension
+    :param postings: iterable of lists of ints
+    '''
+    offsets = array.array('Q', [0])
+    with open(path + ".ids", 'wb') as f:
+        for ids in postings:
+            write_array(f, array.array('I', ids))
+            offsets.append(offsets[-1] + len(ids))
+    with open(path + ".off", 'wb') as f:
+        write_array(f, offsets)
+
+
+def map_file(path):
+    '''Memory-map a file for reading
+    :param path: string with the path to the file
+    :return: a read-only mmap, or empty bytes for an empty file, which cannot be mapped
+    '''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_array(f, values):
+    '''Write an array to a file in the byte order of the index, see index_byteorder
+    :param f: file opened for writing in binary mode
+    :param values: array.array with the values
+    '''
+    if sys.byteorder != index_byteorder:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def map_array(path, typecode):
+    '''Memory-map an array written by write_array()
+    :param path: string with the path to the file
+    :param typecode: string with the array typecode of the values, e.g. 'Q'
+    :return: a tuple with the mmap, see map_file(), and a memoryview of the values. On big-endian platforms the values
+     are a byteswapped array.array in memory instead
+    '''
+    m = map_file(path)
+    if sys.byteorder != index_byteorder:
+        values = array.array(typecode)
+        values.frombytes(m)
+        values.byteswap()
+        return m, values
+    return m, memoryview(m).cast('B').cast(typecode)
+
+
+def release_array(m, values):
+    '''Release an array from map_array() and close its mmap
+    :param m: the mmap, or empty bytes for an empty file
+    :param values: the memoryview or array.array of the values
+    '''
+    if isinstance(values, memoryview):
+        values.release()
+    if isinstance(m, mmap.mmap):
+        m.close()
+
+
+def build_index(state, index_dir):
+    '''Build an on-disk inverted index from cx patterns and elements to the trees they occur in, see open_index()
+    :param state: CountState from extract_corpus(), with instance spill files
+    :param index_dir: string with the path to the folder for the index files
+
+    For both the narrow and the broad patterns the index holds a sorted pattern table, pattern -> tree postings and
+    element -> pattern postings, all as fixed-width little-endian arrays that can be memory-mapped. The tree postings
+    are filled in with one sequential pass over the instance spill files.
+    '''
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    table = state.patterns
+    decode = state.vocab.decode
+
+    levels = {}
+    for level, patterns, counts in (("narrow", table.narrow, table.counts), ("broad", table.broad_patterns, None)):
+        strings = [decode(pattern) for pattern in patterns]
+        order = sorted(range(len(strings)), key=strings.__getitem__)
+        position = array.array('I', bytes(4 * len(strings)))
+        for pos, row in enumerate(order):
+            position[row] = pos
+        write_string_table(os.path.join(index_dir, level + "_patterns"), [strings[row] for row in order])
+
+        # element -> pattern postings, in sorted pattern order
+        element_postings = {}
+        for pos, row in enumerate(order):
+            for e in set(strings[row].split(" ")):
+                element_postings.setdefault(e, []).append(pos)
+        elements = sorted(element_postings)
+        write_string_table(os.path.join(index_dir, level + "_elements"), elements)
+        write_postings(os.path.join(index_dir, level + "_element_postings"), [element_postings[e] for e in elements])
+        levels[level] = position
+
+    # the number of trees of each pattern is known from the counts, so the pattern -> tree postings can be laid out
+    # in advance and filled in as the trees are read
+    sizes = {"narrow": array.array('Q', bytes(8 * len(table.narrow))), "broad": array.array('Q', bytes(8 * len(table.broad_patterns)))}
+    for row, count in enumerate(table.counts):
+        sizes["narrow"][levels["narrow"][row]] += count
+        sizes["broad"][levels["broad"][table.broad[row]]] += count
+    postings = {}
+    for level, level_sizes in sizes.items():
+        offsets = array.array('Q', [0])
+        for size in level_sizes:
+            offsets.append(offsets[-1] + size)
+        path = os.path.join(index_dir, level + "_tree_postings")
+        with open(path + ".off", 'wb') as f:
+            write_array(f, offsets)
+        with open(path + ".ids", 'wb') as f:
+            f.truncate(4 * offsets[-1])
+        postings[level] = (path + ".ids", offsets[:-1])
+
+    files = dict((level, open(path, 'r+b')) for level, (path, cursor) in postings.items())
+    maps = dict((level, mmap.mmap(f.fileno(), 0) if os.fstat(f.fileno()).st_size else None) for level, f in files.items())
+    views = dict((level, memoryview(m).cast('I') if m is not None else None) for level, m in maps.items())
+    swap = sys.byteorder != index_byteorder
+    tree_offsets = array.array('Q', [0])
+    tree_no = 0
+    try:
+        with open(os.path.join(index_dir, "trees.str"), 'wb') as trees_out:
+            trees_writer = RowWriter(trees_out)
+            for narrow, tree_id, file_name in iter_instances(state):
+                encoded = "{}\t{}".format(tree_id, file_name).encode("utf-8")
+                trees_writer.write(encoded)
+                tree_offsets.append(tree_offsets[-1] + len(encoded))
+                row = table.index[state.vocab.encode(narrow.split(" "))]
+                # the views are in the platform byte order, so the tree number is swapped into the byte order of the index
+                stored_no = int.from_bytes(tree_no.to_bytes(4, sys.byteorder), index_byteorder) if swap else tree_no
+                for level, pos in (("narrow", levels["narrow"][row]), ("broad", levels["broad"][table.broad[row]])):
+                    cursor = postings[level][1]
+                    views[level][cursor[pos]] = stored_no
+                    cursor[pos] += 1
+                tree_no += 1
+            trees_writer.flush()
+    finally:
+        for level in files:
+            if views[level] is not None:
+                views[level].release()
+                maps[level].close()
+            files[level].close()
+    with open(os.path.join(index_dir, "trees.off"), 'wb') as f:
+        write_array(f, tree_offsets)
+
+    with open(os.path.join(index_dir, "index.json"), 'w') as f:
+        json.dump({"version": index_version, "byteorder": index_byteorder, "trees": tree_no,
+                   "narrow_patterns": len(table.narrow), "broad_patterns": len(table.broad_patterns)}, f)
+
+
+class StringTable(object):
+    '''Memory-mapped table of strings written by write_string_table(). Sorted tables can be searched with find()'''
+
+    def __init__(self, path):
+        self.blob = map_file(path + ".str")
+        self.offsets_map, self.offsets = map_array(path + ".off", 'Q')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def find(self, string):
+        '''Binary search for a string in a sorted table
+        :param string: string to look up
+        :return: int with the position of the string, or -1 if it is not in the table
+        '''
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < string:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self[lo] == string:
+            return lo
+        return -1
+
+    def close(self):
+        release_array(self.offsets_map, self.offsets)
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+
+
+class Postings(object):
+    '''Memory-mapped lists of ints written by write_postings()'''
+
+    def __init__(self, path):
+        self.ids_map, self.ids = map_array(path + ".ids", 'I')
+        self.offsets_map, self.offsets = map_array(path + ".off", 'Q')
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def close(self):
+        release_array(self.ids_map, self.ids)
+        release_array(self.offsets_map, self.offsets)
+
+
+class TreeIndex(object):
+    '''Query an index built by build_index() without loading it into memory, see open_index()'''
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "index.json")) as f:
+            self.info = json.load(f)
+        if self.info["version"] != index_version or self.info.get("byteorder") != index_byteorder:
+            raise ValueError("Index in {} was built by another version of TreeNet, rebuild it.".format(index_dir))
+        self.trees = StringTable(os.path.join(index_dir, "trees"))
+        self.tables = {}
+        for level in ("narrow", "broad"):
+            path = os.path.join(index_dir, level)
+            self.tables[level] = (StringTable(path + "_patterns"), Postings(path + "_tree_postings"),
+                                  StringTable(path + "_elements"), Postings(path + "_element_postings"))
+
+    def lookup(self, pattern, broad=False):
+        '''Find the trees in which a cx pattern occurs
+        :param pattern: string with a cx pattern, e.g. "ADVP-TMP BED NP-SBJ-D-N ADJP"
+        :param broad: bool, look up a broad pattern, e.g. "ADVP-TMP BE NP-SBJ". Defaults to False
+        :return: a list of (tree ID, file name) tuples, in corpus order
+        '''
+        patterns, tree_postings = self.tables["broad" if broad else "narrow"][:2]
+        pos = patterns.find(pattern)
+        if pos == -1:
+            return []
+        return [tuple(self.trees[tree_no].split("\t")) for tree_no in tree_postings[pos]]
+
+    def containing(self, element, broad=False):
+        '''Find the cx patterns that contain an element
+        :param element: string with a cleaned element, e.g. "NP-SBJ-*exp*"
+        :param broad: bool, search the broad patterns. Defaults to False
+        :return: a sorted list of cx pattern strings
+        '''
+        patterns, tree_postings, elements, element_postings = self.tables["broad" if broad else "narrow"]
+        pos = elements.find(element)
+        if pos == -1:
+            return []
+        return [patterns[pattern_no] for pattern_no in element_postings[pos]]
+
+    def close(self):
+        self.trees.close()
+        for tables in self.tables.values():
+            for table in tables:
+                table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_index(index_dir):
+    '''Open an inverted index built with get_constructions(..., index_dir=...)
+    :param index_dir: string with the path to the index folder
+    :return: a TreeIndex, with lookup(pattern) and containing(element) queries
+    '''
+    return TreeIndex(index_dir)
+
+
+# Count snapshot functions
+
+def write_block(f, data):
+    '''Write bytes with their length in front, see read_block()'''
+    f.write(struct.pack('<Q', len(data)))
+    f.write(data)
+
+
+def read_block(f):
+    '''Read bytes written by write_block()'''
+    size = f.read(8)
+    if len(size) < 8:
+        raise ValueError("Snapshot file is truncated.")
+    size = struct.unpack('<Q', size)[0]
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("Snapshot file is truncated.")
+    return data
+
+
+def state_record(state):
+    '''Turn the count state of a single corpus file into a snapshot record
+    :param state: CountState for one corpus file, see extract_file()
+    :return: a tuple with a dict of the file name, tags, sentence counts and counters, a dict of arrays (see
+     snapshot_arrays) and bytes with the contents of the instance spill file
+    '''
+    vocab = state.vocab
+    table = state.patterns
+    info = {"file": state.filenames_list[0], "tags": vocab.tags, "sent_count": state.sent_count, "counters": state.counters}
+    itemsize = array.array(element_id_typecode).itemsize
+    arrays = {"element_counts": array.array('q', state.element_counts + [0] * (len(vocab) - len(state.element_counts))),
+              "narrow": array.array(element_id_typecode, b"".join(table.narrow)),
+              "narrow_lengths": array.array('I', [len(pattern) // itemsize for pattern in table.narrow]),
+              "counts": table.counts,
+              "broad": array.array('q', table.broad),
+              "broad_patterns": array.array(element_id_typecode, b"".join(table.broad_patterns)),
+              "broad_lengths": array.array('I', [len(pattern) // itemsize for pattern in table.broad_patterns])}
+    spill = b""
+    if state.spill_files[0]:
+        with open(state.spill_files[0], 'rb') as f:
+            spill = f.read()
+    return info, arrays, spill
+
+
+def record_state(record, spill_path):
+    '''Turn a snapshot record back into a count state, see state_record()
+    :param record: tuple with a snapshot record
+    :param spill_path: string with the path where the instances of the record are written
+    :return: CountState for one corpus file
+    '''
+    info, arrays, spill = record
+    state = CountState()
+    for tag in info["tags"]:
+        state.vocab.add(tag)
+    state.element_counts = arrays["element_counts"].tolist()
+    def split_patterns(ids, lengths):
+        patterns = []
+        pos = 0
+        for length in lengths:
+            patterns.append(ids[pos:pos + length].tobytes())
+            pos += length
+        return patterns
+    broad_patterns = split_patterns(arrays["broad_patterns"], arrays["broad_lengths"])
+    counts, broad = arrays["counts"], arrays["broad"]
+    for row, narrow in enumerate(split_patterns(arrays["narrow"], arrays["narrow_lengths"])):
+        state.patterns.add(narrow, broad_patterns[broad[row]], counts[row])
+    state.sent_count = info["sent_count"]
+    state.filenames_list.append(info["file"])
+    state.counters = info["counters"]
+    with open(spill_path, 'wb') as f:
+        f.write(spill)
+    state.spill_files.append(spill_path)
+    return state
+
+
+def write_snapshot_file(snapshot_path, records, fingerprint, n_files):
+    '''Write snapshot records to a gzip compressed snapshot file
+    :param snapshot_path: string with the path of the snapshot
+    :param records: iterable of snapshot records, in corpus file order
+    :param fingerprint: string with the extractor fingerprint of the counts, see extractor_fingerprint()
+    :param n_files: int with the number of records
+    '''
+    header = {"version": snapshot_version, "byteorder": sys.byteorder, "fingerprint": fingerprint, "files": n_files}
+    # write to a temporary file first, so that an interrupted run never leaves a broken snapshot behind
+    with gzip.open(snapshot_path + ".tmp", 'wb', compresslevel=1) as f:
+        f.write(snapshot_magic)
+        write_block(f, json.dumps(header).encode("utf-8"))
+        for info, arrays, spill in records:
+            write_block(f, json.dumps(info).encode("utf-8"))
+            for name, typecode in snapshot_arrays:
+                write_block(f, arrays[name].tobytes())
+            write_block(f, spill)
+        # an empty block ends the records
+        write_block(f, b"")
+    os.replace(snapshot_path + ".tmp", snapshot_path)
+
+
+def iter_snapshot(snapshot_path):
+    '''Read a snapshot file written by write_snapshot_file(), one record at a time
+    :param snapshot_path: string with the path of the snapshot
+    :return: a generator that yields the header dict of the snapshot first, then its records
+    '''
+    with gzip.open(snapshot_path, 'rb') as f:
+        if f.read(len(snapshot_magic)) != snapshot_magic:
+            raise ValueError("{} is not a TreeNet snapshot.".format(snapshot_path))
+        header = json.loads(read_block(f).decode("utf-8"))
+        if header["version"] != snapshot_version:
+            raise ValueError("Snapshot {} has version {}, expected {}.".format(snapshot_path, header["version"], snapshot_version))
+        swap = header["byteorder"] != sys.byteorder
+        yield header
+        while True:
+            info = read_block(f)
+            if not info:
+                return
+            arrays = {}
+            for name, typecode in snapshot_arrays:
+                arrays[name] = array.array(typecode, read_block(f))
+                if swap:
+                    arrays[name].byteswap()
+            yield json.loads(info.decode("utf-8")), arrays, read_block(f)
+
+
+def iter_snapshot_records(snapshot_paths):
+    '''Read the records of several snapshots as one stream, in corpus file order
+    :param snapshot_paths: list of strings with the paths of the snapshots
+    :return: a tuple with the extractor fingerprint, the number of files and a generator of records
+
+    Each snapshot holds its files in order, so the streams are merged like sorted lists, with one record of each
+    snapshot in memory at a time.
+    '''
+    streams = [iter_snapshot(path) for path in snapshot_paths]
+    headers = [next(stream) for stream in streams]
+    fingerprints = set(header["fingerprint"] for header in headers)
+    if len(fingerprints) > 1:
+        raise ValueError("The snapshots were made with different versions of TreeNet's cleaning rules.")
+    def records():
+        previous = None
+        # the same order as the sorted .psd paths of a run on a single node
+        for record in heapq.merge(*streams, key=lambda record: record[0]["file"] + ".psd"):
+            if record[0]["file"] == previous:
+                raise ValueError("Corpus file {} is in more than one snapshot.".format(previous))
+            previous = record[0]["file"]
+            yield record
+    return fingerprints.pop(), sum(header["files"] for header in headers), records()
+
+
+def write_snapshot(corpus_files, snapshot_path, workers=1, cache_dir=None):
+    '''Count the constructions of a set of corpus files, e.g. one node's share of a corpus, and save the raw counts
+    and instances in a snapshot, to be merged with merge_snapshots() or merge_constructions()
+    :param corpus_files: string with the path to a folder, archive or corpus file, or a list of them, see find_corpus_files()
+    :param snapshot_path: string with the path of the snapshot file
+    :param workers: int with number of processes used to read the corpus files in parallel. Defaults to 1
+    :param cache_dir: string with the path to a folder for caching the counts of each corpus file. Defaults to None (no cache)
+    :return: int with the number of corpus files in the snapshot
+    '''
+    parsed_files = find_corpus_files(corpus_files)
+    spill_dir = None if cache_dir else tempfile.mkdtemp(prefix="treenet_spill_")
+    try:
+        records = (state_record(partial) for file, partial in iter_file_states(parsed_files, int(workers), cache_dir, spill_dir))
+        write_snapshot_file(snapshot_path, records, extractor_fingerprint(), len(parsed_files))
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir)
+    return len(parsed_files)
+
+
+def merge_snapshots(snapshot_paths, snapshot_path):
+    '''Merge snapshots into one snapshot, e.g. to combine the snapshots of several nodes in stages. Merging is
+    associative: the files are kept in corpus order, whichever way the snapshots are grouped
+    :param snapshot_paths: list of strings with the paths of the snapshots to merge
+    :param snapshot_path: string with the path of the merged snapshot
+    '''
+    fingerprint, n_files, records = iter_snapshot_records(snapshot_paths)
+    write_snapshot_file(snapshot_path, records, fingerprint, n_files)
+
+
+def load_snapshots(snapshot_paths, spill_dir, facets=None, metrics=None):
+    '''Merge the counts of snapshots into a count state, see extract_corpus()
+    :param snapshot_paths: list of strings with the paths of the snapshots
+    :param spill_dir: string with the path to a folder where the instances of the snapshots are written
+    :param facets: list of facet names to keep counts by facet value for, see CountState. Defaults to None
+    :param metrics: RunMetrics that is updated after each file. Defaults to None
+    :return: the merged count state
+    '''
+    fingerprint, n_files, records = iter_snapshot_records(snapshot_paths)
+    if metrics:
+        metrics.files_total = n_files
+    merged = CountState(facets)
+    for i, record in enumerate(records):
+        merged.merge(record_state(record, os.path.join(spill_dir, "{:06d}_{}.spill".format(i, record[0]["file"]))))
+        if metrics:
+            metrics.file_done(merged)
+    return merged
+
+
+# Instrumentation
+
+class RunMetrics(object):
+    '''Progress, counters and stage timings of a get_constructions() run, reported to an optional progress callback
+
+    The callback is called as progress(event, metrics), with event "file" after each corpus file has been counted, and
+    with the name of a stage ("sketch", "extract", "merge", "score", "significance", "mine", "write" or "index") when that stage has finished. See print_progress().
+    '''
+    __slots__ = ("progress", "files_total", "files_done", "trees_seen", "trees_kept", "trees_dropped",
+                 "constituents_skipped", "patterns", "stages")
+
+    def __init__(self, files_total=0, progress=None):
+        self.progress = progress
+        self.files_total = files_total
+        self.files_done = 0
+        self.trees_seen = 0
+        self.trees_kept = 0
+        self.trees_dropped = 0
+        self.constituents_skipped = 0
+        self.patterns = 0
+        # wall clock and CPU seconds of each stage. The CPU time is that of the main process only, so it leaves out
+        # the worker processes when workers > 1
+        self.stages = collections.OrderedDict()
+
+    def file_done(self, state):
+        '''Update the totals after a corpus file has been added to the count state
+        :param state: CountState with the counts of all files so far, or ClauseStates, where each clause counts as a tree
+        '''
+        states = state.states if isinstance(state, ClauseStates) else [state]
+        self.files_done += 1
+        self.trees_seen = sum(sum(state.sent_count.values()) for state in states)
+        self.trees_dropped = sum(state.counters["trees_dropped"] for state in states)
+        self.constituents_skipped = sum(state.counters["constituents_skipped"] for state in states)
+        # every tree is either counted or dropped by the filter in extract_file()
+        self.trees_kept = self.trees_seen - self.trees_dropped
+        self.patterns = sum(len(state.patterns.counts) for state in states)
+        if self.progress:
+            self.progress("file", self)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Time a stage of the run, as a context manager
+        :param name: string with the name of the stage
+        '''
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        self.stages[name] = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+        if self.progress:
+            self.progress(name, self)
+
+    def as_dict(self):
+        '''The metrics as a dict, e.g. for saving as JSON'''
+        return dict((k, getattr(self, k)) for k in self.__slots__ if k != "progress")
+
+
+def print_progress(event, metrics):
+    '''Progress callback for get_constructions() that prints a line for each file and stage to stderr'''
+    if event == "file":
+        sys.stderr.write("{}/{} files, {} trees, {} kept, {} patterns\n".format(metrics.files_done, metrics.files_total,
+                                                                          metrics.trees_seen, metrics.trees_kept, metrics.patterns))
+    else:
+        sys.stderr.write("{} done in {:.2f}s\n".format(event, metrics.stages[event]["wall"]))
+
+
+# *Main function* 
+
+def check_output_options(sep, facets, replicates=0, resample="trees", clauses=None):
+    '''Stop with a message if the output options of get_constructions() or merge_constructions() are not valid'''
+    # The safe ouput file field separators are \t and ;
+    # Reason: cx patterns contain white space and dashes, tree-token IDs contain commas.
+    if sep not in ("\t", ";"):
+        sys.exit("Output field separator must be one of tabulator or semi-colon. Other values *will* cause problems.")
+    if any(facet not in facet_names for facet in facets or []):
+        sys.exit("Facets must be among {}.".format(", ".join(facet_names)))
+    if replicates and np is None:
+        sys.exit("Confidence intervals and p-values (replicates) need NumPy.")
+    if resample not in ("trees", "files"):
+        sys.exit("Resampling unit must be one of trees or files.")
+    if clauses is not None and (isinstance(clauses, str) or not clauses or any(not label or re.search(r'[\s()]', label) for label in clauses)):
+        sys.exit("Clause labels must be a list of labels without spaces or brackets, e.g. [\"IP-MAT\", \"IP-SUB\"].")
+
+
+def run_stage(metrics, name):
+    '''Time a stage with RunMetrics.stage(), or do nothing when metrics is None'''
+    return metrics.stage(name) if metrics else contextlib.nullcontext()
+
+
+def write_results(state, out_folder, min_freq, sep, compress, index_dir, facets, metrics, subpatterns=False, subpattern_length=None,
+                  replicates=0, resample="trees", seed=0, workers=1):
+    '''Prune, score and write the constructions of a count state, see get_constructions() for the parameters. The
+    clause types of ClauseStates are scored on their own and written one after the other, with a clause_type column
+    :return: a tuple with the number of construction types and tokens that passed the frequency threshold
+    '''
+    if isinstance(state, ClauseStates):
+        clause_states = list(zip(state.labels, state.states))
+    else:
+        clause_states = [(None, state)]
+
+    with run_stage(metrics, "score"):
+        clause_scores = []
+        for clause_type, clause_state in clause_states:
+            pruned_rows = [row for row, v in enumerate(clause_state.patterns.counts) if v >= min_freq]
+            cx_metrics = get_state_total_correlation(clause_state, pruned_rows)
+            # each facet value is scored as if its files were the whole corpus
+            facet_metrics = []
+            for facet in facets:
+                values = clause_state.facets[facet]
+                for value in sorted(values, key=str):
+                    facet_counts = values[value]
+                    facet_rows = sorted(row for row, v in facet_counts.counts.items() if v >= min_freq)
+                    facet_metrics.append((facet, value, facet_counts, facet_rows, get_state_total_correlation(clause_state, facet_rows, facet_counts)))
+            clause_scores.append((pruned_rows, cx_metrics, facet_metrics))
+
+    if replicates:
+        with run_stage(metrics, "significance"):
+            clause_significance = [bootstrap_significance(clause_state, pruned_rows, int(replicates), resample, seed, workers)
+                                   for (clause_type, clause_state), (pruned_rows, cx_metrics, facet_metrics) in zip(clause_states, clause_scores)]
+
+    if subpatterns:
+        with run_stage(metrics, "mine"):
+            clause_subpatterns = [mine_subpatterns(clause_state, min_freq, subpattern_length) for clause_type, clause_state in clause_states]
+
+    with run_stage(metrics, "write"):
+        current_time = time.strftime("%Y-%m-%d_%H_%M")
+        base_name_out_aggregated = "treenet_aggregated_{}.txt".format(current_time)
+        base_name_out_full = "treenet_full_data_{}.txt{}".format(current_time, ".gz" if compress else "")
+        clause_column = ["clause_type"] if clause_states[0][0] else []
+        
+        out_agg = open(os.path.join(out_folder, base_name_out_aggregated), 'w')
+        
+        # write header:
+        out_agg_header = clause_column + ["cx_broad", "cx_narrow", "freq", "rel_freq", "specific_correlation"]
+        if replicates:
+            out_agg_header.extend(["ci_low", "ci_high", "p_value"])
+        out_agg_header_str = sep.join(out_agg_header)
+        out_agg.write("{}\n".format(out_agg_header_str))
+
+        if subpatterns:
+            out_sub = open(os.path.join(out_folder, "treenet_subpatterns_{}.txt".format(current_time)), 'w')
+            out_sub.write("{}\n".format(sep.join(clause_column + ["kind", "level", "cx", "freq", "rel_freq", "specific_correlation"])))
+        
+        for c, ((clause_type, clause_state), (pruned_rows, cx_metrics, facet_metrics)) in enumerate(zip(clause_states, clause_scores)):
+            table = clause_state.patterns
+            decode = clause_state.vocab.decode
+            prefix = [clause_type] if clause_type else []
+
+            # the patterns are only turned back into strings here, for writing
+            cx_pruned_metrics = {}
+            for i, (row, my_metrics) in enumerate(zip(pruned_rows, cx_metrics)):
+                k = decode(table.narrow[row])
+                k_broad = decode(table.broad_patterns[table.broad[row]])
+                v = table.counts[row]
+                cx_pruned_metrics[k] = k_broad, my_metrics[0], my_metrics[1]
+                
+                out_agg_values = prefix + [k_broad, k, v, my_metrics[0], my_metrics[1]]
+                if replicates:
+                    out_agg_values.extend(clause_significance[c][i])
+                out_agg_values_str = sep.join([str(x) for x in out_agg_values])
+                out_agg.write("{}\n".format(out_agg_values_str))
+            
+            write_full_data(clause_state, cx_pruned_metrics, os.path.join(out_folder, base_name_out_full), sep=sep,
+                            clause_type=clause_type, append=c > 0)
+
+            if facets:
+                write_facet_data(clause_state, facet_metrics, os.path.join(out_folder, "treenet_facets_{}.txt".format(current_time)), sep=sep,
+                                 clause_type=clause_type, append=c > 0)
+
+            if subpatterns:
+                out_sub.writelines("{}\n".format(sep.join([str(x) for x in prefix + list(row)])) for row in clause_subpatterns[c])
+        
+        # close filehandles before exiting
+        out_agg.close()
+        if subpatterns:
+            out_sub.close()
+    
+    if index_dir:
+        with run_stage(metrics, "index"):
+            # one index for each clause type, in a sub-folder named after the clause label
+            for clause_type, clause_state in clause_states:
+                build_index(clause_state, os.path.join(index_dir, clause_type) if clause_type else index_dir)
+
+    return (sum(len(pruned_rows) for pruned_rows, cx_metrics, facet_metrics in clause_scores),
+            sum(clause_state.patterns.counts[row] for (clause_type, clause_state), (pruned_rows, cx_metrics, facet_metrics) in zip(clause_states, clause_scores)
+                for row in pruned_rows))
+
+
+def get_constructions(corpus_files, out_folder, min_freq=5, sep="\t", workers=1, cache_dir=None, compress=False, index_dir=None,
+                      facets=None, sketch_mb=None, subpatterns=False, subpattern_length=None, replicates=0, resample="trees", seed=0,
+                      clauses=None, progress=None, metrics_path=None, profile_path=None):
+
+    '''Main function to extract construction candidates from the parsed PPME2 files
+    :param corpus files: string with the path to folder containing corpus parsed files (*.psd), searched recursively, or to an
+     archive or a corpus file, or a list of them. Files may be compressed (*.psd.gz, .bz2, .xz) or in zip and tar archives, see find_corpus_files()
+    :param out_folder: string with the path to folder where results are saved
+    :param min_freq: int with minimum number of cx occurrences. Defaults to 5
+    :param sep: string with output file field separator. "\t" (default) or ";"  
+    :param workers: int with number of processes used to read the corpus files in parallel. Defaults to 1
+    :param cache_dir: string with the path to a folder for caching the counts of each corpus file, so that reruns only read new or changed files. Defaults to None (no cache)
+    :param compress: bool, gzip the individual results file (treenet_full_data_*.txt.gz). Defaults to False
+    :param index_dir: string with the path to a folder for an inverted index from patterns and elements to trees, see open_index(). Defaults to None (no index)
+    :param facets: list of facet names, e.g. ["period", "dialect"], to count and score the constructions separately for each
+     value of, in the same pass over the corpus, see file_facets(). Any of "period", "genre", "dialect" and "year". Defaults to None
+    :param sketch_mb: float with the size in megabytes of a count-min sketch for an approximate first pass over the corpus.
+     The second pass only counts the patterns that may occur min_freq times, so the results are the same but memory use is
+     bounded by the size of the sketch and of the frequent patterns. Reads the corpus twice, in one process and without
+     a cache. Defaults to None (one exact pass)
+    :param subpatterns: bool, also find the contiguous and gapped sub-patterns of the clause patterns that occur in at
+     least min_freq trees, e.g. "NP-SBJ BE", and score them in treenet_subpatterns_*.txt, see mine_subpatterns(). Defaults to False
+    :param subpattern_length: int with the maximum number of elements in a sub-pattern. Defaults to None (no limit)
+    :param replicates: int with the number of bootstrap replicates for a confidence interval and a p-value of the
+     specific_correlation of each construction, added as columns to treenet_aggregated_*.txt, see bootstrap_significance().
+     Needs NumPy. Defaults to 0 (no intervals)
+    :param resample: "trees" to resample the trees of the corpus, or "files" to resample whole corpus files. Defaults to "trees"
+    :param seed: int with the seed of the bootstrap replicates. Defaults to 0
+    :param clauses: list of clause labels, e.g. ["IP-MAT", "IP-SUB", "IP-INF", "CP-REL"], to extract at any depth of
+     each tree and count and score separately, in the same pass over the corpus, see extract_clauses(). The output
+     files get a first clause_type column, and the index a sub-folder for each label. Defaults to None (only the
+     IP-MAT at the top of each tree, without a clause_type column)
+    :param progress: callable called with the progress of the run, e.g. print_progress(), see RunMetrics. Defaults to None
+    :param metrics_path: string with the path of a JSON file for the counters and stage timings of the run. Defaults to None
+    :param profile_path: string with the path of a file for cProfile statistics of the run, see the pstats module. Defaults to None
+    :return: prints results to two files - aggregated results and individual results (one row per occurrence) with metadata -
+     and a third file with the aggregated results for each facet value when facets are given
+    '''
+    if profile_path:
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(get_constructions, corpus_files, out_folder, min_freq, sep, workers, cache_dir,
+                                    compress, index_dir, facets, sketch_mb, subpatterns, subpattern_length, replicates, resample, seed,
+                                    clauses, progress, metrics_path)
+        finally:
+            profiler.dump_stats(profile_path)
+
+    check_output_options(sep, facets, replicates, resample, clauses)
+    # make sure that the minimum frequency threshold is an integer:
+    min_freq = int(min_freq)
+    facets = list(facets or [])
+    
+    # sorted, so that the output does not depend on the file system order
+    parsed_files = find_corpus_files(corpus_files)
+    
+    # check that at least 1 corpus file was found:
+    if len(parsed_files) == 0:
+        sys.exit("No .psd parsed corpus files found in location.")
+    
+    # the occurrences are spilled to disk during extraction, and only the ones above min_freq are kept afterwards.
+    # With a cache, the spill files are kept in the cache folder instead.
+    spill_dir = None if cache_dir else tempfile.mkdtemp(prefix="treenet_spill_")
+    # the metrics are only kept when asked for, otherwise the stages are not timed
+    metrics = RunMetrics(len(parsed_files), progress) if progress or metrics_path else None
+    try:
+        keep = None
+        if sketch_mb:
+            if int(workers) > 1 or cache_dir:
+                sys.exit("The approximate mode (sketch_mb) reads the corpus in a single process and without a cache.")
+            if subpatterns:
+                sys.exit("Sub-patterns need the counts of all patterns, which the approximate mode (sketch_mb) does not keep.")
+            if replicates and resample == "files":
+                sys.exit("Resampling files needs the instances of all patterns, which the approximate mode (sketch_mb) does not keep.")
+            if clauses:
+                sys.exit("The approximate mode (sketch_mb) only counts the IP-MAT at the top of each tree, without clauses.")
+            with run_stage(metrics, "sketch"):
+                sketch = CountMinSketch(float(sketch_mb))
+                sketch_corpus(parsed_files, sketch)
+                keep = functools.partial(sketch.frequent, min_freq=min_freq)
+
+        # iterate over files in directory
+        with run_stage(metrics, "extract"):
+            state = extract_corpus(parsed_files, workers=int(workers), cache_dir=cache_dir, spill_dir=spill_dir, metrics=metrics,
+                                   facets=facets, keep=keep, clauses=clauses)
+        n_types, n_tokens = write_results(state, out_folder, min_freq, sep, compress, index_dir, facets, metrics,
+                                          subpatterns, subpattern_length, replicates, resample, seed, int(workers))
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir)
+
+    if metrics_path:
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics.as_dict(), f, indent=2)
+    
+    print("Found {} types and {} tokens".format(n_types, n_tokens))
+
+
+def merge_constructions(snapshot_paths, out_folder, min_freq=5, sep="\t", compress=False, index_dir=None, facets=None,
+                        subpatterns=False, subpattern_length=None, replicates=0, resample="trees", seed=0, progress=None,
+                        metrics_path=None):
+    '''Write the results of get_constructions() from snapshots of the counts, e.g. from several nodes, see write_snapshot()
+    :param snapshot_paths: list of strings with the paths of the snapshots. Each corpus file may only be in one of them
+    :param out_folder: string with the path to folder where results are saved
+
+    The other parameters are the same as for get_constructions(). The results are the same as those of a run of
+    get_constructions() on all the corpus files of the snapshots.
+    '''
+    check_output_options(sep, facets, replicates, resample)
+    min_freq = int(min_freq)
+    facets = list(facets or [])
+    if len(snapshot_paths) == 0:
+        sys.exit("No snapshots to merge.")
+
+    spill_dir = tempfile.mkdtemp(prefix="treenet_spill_")
+    metrics = RunMetrics(0, progress) if progress or metrics_path else None
+    try:
+        with run_stage(metrics, "merge"):
+            state = load_snapshots(snapshot_paths, spill_dir, facets=facets, metrics=metrics)
+        n_types, n_tokens = write_results(state, out_folder, min_freq, sep, compress, index_dir, facets, metrics,
+                                          subpatterns, subpattern_length, replicates, resample, seed)
+    finally:
+        shutil.rmtree(spill_dir)
+
+    if metrics_path:
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics.as_dict(), f, indent=2)
+
+    print("Found {} types and {} tokens".format(n_types, n_tokens))
+    
+    
+if __name__ == "__main__":
+
+    user_args = sys.argv[1:]
+    # progress is printed to stderr only when asked for, e.g. python treenet.py --progress <data_path> <output_path>
+    run_progress = print_progress if "--progress" in user_args else None
+    user_args = [arg for arg in user_args if arg != "--progress"]
+    if user_args and user_args[0] == "snapshot":
+        # python treenet.py snapshot <data_path> <snapshot_path> [workers]
+        if len(user_args) < 3:
+            sys.exit("To make a snapshot, specify the path to corpus files and the path of the snapshot file")
+        write_snapshot(user_args[1], user_args[2], workers=user_args[3] if len(user_args) > 3 else 1)
+    elif user_args and user_args[0] == "merge":
+        # python treenet.py merge [--progress] [--min-freq N] [--sep ";"] [--replicates N] [--resample files] [--seed N] <output_path> <snapshot> [<snapshot> ...]
+        # python treenet.py merge --snapshot <merged_snapshot> <snapshot> [<snapshot> ...]
+        parser = argparse.ArgumentParser(prog="treenet.py merge", description="Merge TreeNet count snapshots")
+        parser.add_argument("--snapshot", action="store_true", help="write a merged snapshot instead of the results")
+        parser.add_argument("--min-freq", type=int, default=5)
+        parser.add_argument("--sep", default="\t")
+        parser.add_argument("--replicates", type=int, default=0, help="bootstrap replicates for confidence intervals and p-values")
+        parser.add_argument("--resample", choices=("trees", "files"), default="trees")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--progress", action="store_true", help="print the progress of the merge to stderr")
+        parser.add_argument("out")
+        parser.add_argument("snapshots", nargs="+")
+        merge_args = parser.parse_args(user_args[1:])
+        if merge_args.snapshot:
+            merge_snapshots(merge_args.snapshots, merge_args.out)
+        else:
+            merge_constructions(merge_args.snapshots, merge_args.out, min_freq=merge_args.min_freq, sep=merge_args.sep,
+                                replicates=merge_args.replicates, resample=merge_args.resample, seed=merge_args.seed, progress=run_progress)
+    elif len(user_args) < 2:
         sys.exit("To use script, specify minimum the path to corpus files and an output directory")
     elif len(user_args) == 2:
-        get_constructions(corpus_files=user_args[0], out_folder=user_args[1])
+        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], progress=run_progress)
     elif len(user_args) == 3:
-        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], min_freq=user_args[2])
+        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], min_freq=user_args[2], progress=run_progress)
+    elif len(user_args) == 4:
+        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], min_freq=user_args[2], sep=user_args[3], progress=run_progress)
     else:
-        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], min_freq=user_args[2], sep=user_args[3])
+        get_constructions(corpus_files=user_args[0], out_folder=user_args[1], min_freq=user_args[2], sep=user_args[3], workers=user_args[4], progress=run_progress)